@@ -1,5 +1,5 @@
 import logging
-from telegram import Update, InputFile
+from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from utils.decorators import restricted
 from utils.message_formatter import (
@@ -9,21 +9,23 @@ from utils.message_formatter import (
     get_confirm_delete_markup,
     get_main_keyboard
 )
-from utils.account_manager import load_accounts, delete_account, clear_all_accounts
-from utils.file_handlers import create_account_zip, create_all_accounts_zip
+from utils.account_store import account_store
+from utils.async_store import async_store, run_blocking
+from utils.export_cache import send_export, single_part
+from utils.account_index import filter_from_args, FilterError
 from utils.localization import get_text, get_user_language
 from handlers.command_handlers import MAIN_MENU, ACCOUNT_LIST, ACCOUNT_DETAIL, ACCOUNT_EDIT, ACCOUNT_DELETE, CONFIRM_DELETE_ALL
 
 @restricted
 async def show_account_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Shows the list of accounts"""
-    accounts = load_accounts()
     lang = get_user_language(context)
+    accounts_count = await async_store.count()
     
     # Save current state in user_data
     context.user_data['state'] = ACCOUNT_LIST
     
-    if not accounts:
+    if not accounts_count:
         if update.callback_query:
             query = update.callback_query
             await query.answer()
@@ -43,18 +45,18 @@ async def show_account_list(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.answer()
         
         if query.data.startswith("page_"):
-            page = int(query.data.split("_")[1])
+            page = int(query.data.split("_", 1)[1])
             context.user_data['page'] = page
         
         await query.edit_message_text(
-            get_text("account_list_title", lang, len(accounts)),
-            reply_markup=get_account_list_markup(accounts, page, context=context)
+            get_text("account_list_title", lang, accounts_count),
+            reply_markup=await run_blocking(get_account_list_markup, account_store, page, context=context)
         )
     else:
         # If this is a regular message, send a new message
         await update.message.reply_text(
-            get_text("account_list_title", lang, len(accounts)),
-            reply_markup=get_account_list_markup(accounts, page, context=context)
+            get_text("account_list_title", lang, accounts_count),
+            reply_markup=await run_blocking(get_account_list_markup, account_store, page, context=context)
         )
     
     return ACCOUNT_LIST
@@ -70,19 +72,17 @@ async def show_account_detail(update: Update, context: ContextTypes.DEFAULT_TYPE
     context.user_data['state'] = ACCOUNT_DETAIL
     
     # Extract account ID from callback_data
-    account_id = query.data.split("_")[1]
+    account_id = query.data.split("_", 1)[1]
     
-    # Load account data
-    accounts = load_accounts()
-    if account_id not in accounts:
+    # Get account data
+    account_data = await async_store.get(account_id)
+    if account_data is None:
         await query.edit_message_text(
             get_text("account_not_found", lang),
-            reply_markup=get_account_list_markup(accounts, context=context)
+            reply_markup=await run_blocking(get_account_list_markup, account_store, context=context)
         )
         return ACCOUNT_LIST
     
-    account_data = accounts[account_id]
-    
     # Save account ID in context for use in other handlers
     context.user_data['current_account'] = account_id
     
@@ -103,10 +103,10 @@ async def delete_account_handler(update: Update, context: ContextTypes.DEFAULT_T
     lang = get_user_language(context)
     
     # Extract account ID from callback_data
-    account_id = query.data.split("_")[1]
+    account_id = query.data.split("_", 1)[1]
     
     # Delete account
-    if delete_account(account_id):
+    if await async_store.delete_account(account_id):
         await query.edit_message_text(get_text("account_deleted", lang))
     else:
         await query.edit_message_text(get_text("account_delete_error", lang))
@@ -145,7 +145,7 @@ async def clear_all_accounts_handler(update: Update, context: ContextTypes.DEFAU
     lang = get_user_language(context)
     
     # Delete all accounts
-    if clear_all_accounts():
+    if await async_store.clear_all_accounts():
         await query.edit_message_text(get_text("all_accounts_cleared", lang))
     else:
         await query.edit_message_text(get_text("clear_all_error", lang))
@@ -190,15 +190,41 @@ async def back_to_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 @restricted
 async def download_all_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Sends ZIP archive with all accounts"""
-    # Create ZIP archive
-    zip_data = create_all_accounts_zip()
+    """Sends ZIP archive with all accounts, /download command may be followed by a filter of accounts"""
     lang = get_user_language(context)
+    query = update.callback_query
+    if query:
+        await query.answer()
+    message = query.message if query else update.message
     
-    if not zip_data:
-        if update.callback_query:
-            query = update.callback_query
-            await query.answer()
+    try:
+        account_filter = filter_from_args(context.args)
+    except FilterError as e:
+        await message.reply_text(
+            get_text("invalid_filter", lang, e),
+            reply_markup=get_main_keyboard(context)
+        )
+        return MAIN_MENU
+    
+    async def send(document, part):
+        caption = get_text("all_accounts", lang)
+        if account_filter:
+            caption += "\n" + get_text("export_filter", lang, account_filter)
+        return await message.reply_document(
+            document=document,
+            caption=caption if part == 1 else get_text("all_accounts_part", lang, part),
+            reply_markup=get_main_keyboard(context)
+        )
+    
+    # Send ZIP archive in parts under the upload limit, the next part is built while one is uploaded;
+    # the same parts are resent by file_id until accounts change
+    if not await send_export(send, 'all', lambda: async_store.all_accounts_zip_parts(account_filter), "accounts.zip", account_filter):
+        if account_filter:
+            await message.reply_text(
+                get_text("no_accounts_match", lang, account_filter),
+                reply_markup=get_main_keyboard(context)
+            )
+        elif query:
             await query.edit_message_text(get_text("account_list_empty", lang))
         else:
             await update.message.reply_text(
@@ -207,27 +233,9 @@ async def download_all_accounts(update: Update, context: ContextTypes.DEFAULT_TY
             )
         return MAIN_MENU
     
-    # Send ZIP archive
-    if update.callback_query:
-        query = update.callback_query
-        await query.answer()
-        
-        # Send ZIP archive
-        await query.message.reply_document(
-            document=InputFile(zip_data, filename="accounts.zip"),
-            caption=get_text("all_accounts", lang),
-            reply_markup=get_main_keyboard(context)
-        )
-        
-        # Edit original message
+    # Edit original message
+    if query:
         await query.edit_message_text(get_text("download_all_accounts", lang))
-    else:
-        # Send ZIP archive
-        await update.message.reply_document(
-            document=InputFile(zip_data, filename="accounts.zip"),
-            caption=get_text("all_accounts", lang),
-            reply_markup=get_main_keyboard(context)
-        )
     
     return MAIN_MENU
 
@@ -239,27 +247,31 @@ async def download_account(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     lang = get_user_language(context)
     
     # Extract account ID from callback_data
-    account_id = query.data.split("_")[1]
+    account_id = query.data.split("_", 1)[1]
     
-    # Load account data
-    accounts = load_accounts()
-    if account_id not in accounts:
+    # Get account data
+    account_data = await async_store.get(account_id)
+    if account_data is None:
         await query.edit_message_text(
             get_text("account_not_found", lang),
-            reply_markup=get_account_list_markup(accounts, context=context)
+            reply_markup=await run_blocking(get_account_list_markup, account_store, context=context)
         )
         return ACCOUNT_LIST
     
-    account_data = accounts[account_id]
-    
-    # Create ZIP archive
-    zip_data = create_account_zip(account_data)
+    async def send(document, part):
+        return await query.message.reply_document(
+            document=document,
+            caption=get_text("account_caption", lang, account_data['login']),
+            reply_markup=get_main_keyboard(context)
+        )
     
     # Send ZIP archive
-    await query.message.reply_document(
-        document=InputFile(zip_data, filename=f"{account_data['login']}.zip"),
-        caption=get_text("account_caption", lang, account_data['login']),
-        reply_markup=get_main_keyboard(context)
+    await send_export(
+        send,
+        'account',
+        lambda: single_part(lambda: async_store.create_account_zip(account_data)),
+        f"{account_data['login']}.zip",
+        account_id
     )
     
     # Edit original message
@@ -1,10 +1,12 @@
 import logging
 import json
-from telegram import Update, InputFile
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
 from utils.decorators import restricted
 from utils.message_formatter import get_main_keyboard
-from utils.file_handlers import create_asf_configs_zip
+from utils.async_store import async_store
+from utils.export_cache import send_export
+from utils.account_index import filter_from_args, FilterError
 from utils.localization import get_text, get_user_language
 from handlers.command_handlers import MAIN_MENU, WAITING_FOR_TEMPLATE
 
@@ -13,11 +15,21 @@ from handlers.command_handlers import MAIN_MENU, WAITING_FOR_TEMPLATE
 
 @restricted
 async def start_asf_config_generation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Starts the ASF config generation process"""
+    """Starts the ASF config generation process, /asf command may be followed by a filter of accounts"""
     lang = get_user_language(context)
     
-    # Save current state in user_data
+    try:
+        account_filter = filter_from_args(context.args)
+    except FilterError as e:
+        await update.message.reply_text(
+            get_text("invalid_filter", lang, e),
+            reply_markup=get_main_keyboard(context)
+        )
+        return MAIN_MENU
+    
+    # Save current state in user_data, the filter is used for the next template
     context.user_data['state'] = WAITING_FOR_TEMPLATE
+    context.user_data['asf_filter'] = account_filter
     
     await update.message.reply_text(
         get_text("send_asf_template", lang),
@@ -40,21 +52,7 @@ async def process_asf_template(update: Update, context: ContextTypes.DEFAULT_TYP
         template_content = text
         json.loads(template_content)
         
-        # Create ZIP archive with configs
-        zip_data = create_asf_configs_zip(template_content)
-        
-        if zip_data:
-            # Send archive to the user
-            await update.message.reply_document(
-                document=InputFile(zip_data, filename="asf_configs.zip"),
-                caption=get_text("asf_configs_generated", lang),
-                reply_markup=get_main_keyboard(context)
-            )
-        else:
-            await update.message.reply_text(
-                get_text("asf_configs_error", lang),
-                reply_markup=get_main_keyboard(context)
-            )
+        await offer_asf_export(update.message, context, template_content)
     except json.JSONDecodeError:
         await update.message.reply_text(
             get_text("invalid_json", lang),
@@ -67,4 +65,87 @@ async def process_asf_template(update: Update, context: ContextTypes.DEFAULT_TYP
             reply_markup=get_main_keyboard(context)
         )
     
-    return MAIN_MENU 
\ No newline at end of file
+    return MAIN_MENU 
+
+async def offer_asf_export(message, context, template_content):
+    """Sends ASF configs for the template, offering only changes if it was exported before"""
+    lang = get_user_language(context)
+    account_filter = context.user_data.pop('asf_filter', None)
+    
+    if not await async_store.has_asf_export(template_content, account_filter):
+        await send_asf_configs(message, context, template_content, account_filter=account_filter)
+        return
+    
+    # Template is kept until the user chooses the kind of export
+    context.user_data['asf_template'] = (template_content, account_filter)
+    keyboard = [
+        [InlineKeyboardButton(get_text("btn_asf_delta", lang), callback_data="asf_export_delta")],
+        [InlineKeyboardButton(get_text("btn_asf_full", lang), callback_data="asf_export_full")]
+    ]
+    await message.reply_text(
+        get_text("asf_export_choice", lang),
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def send_asf_configs(message, context, template_content, delta=False, account_filter=None):
+    """Sends archive with ASF configs of all accounts (or ones matching the filter),
+    for delta only of accounts changed since the last export
+    """
+    lang = get_user_language(context)
+    export = await async_store.asf_export(template_content, delta, account_filter)
+    
+    async def send(document, part):
+        caption = get_text("asf_delta_generated" if delta else "asf_configs_generated", lang)
+        if account_filter:
+            caption += "\n" + get_text("export_filter", lang, account_filter)
+        return await message.reply_document(
+            document=document,
+            caption=caption if part == 1 else get_text("asf_configs_part", lang, part),
+            reply_markup=get_main_keyboard(context)
+        )
+    
+    # Send archive with configs in parts under the upload limit,
+    # the same export is resent by file_id until accounts change
+    if await send_export(
+        send,
+        'asf',
+        lambda: async_store.asf_configs_zip_parts(template_content, export),
+        "asf_configs_delta.zip" if delta else "asf_configs.zip",
+        (export.key, export.since)
+    ):
+        # Next delta export is made against this one
+        await async_store.save_asf_export(export)
+        return
+    
+    if delta:
+        text = get_text("asf_no_changes", lang)
+    elif account_filter:
+        text = get_text("no_accounts_match", lang, account_filter)
+    else:
+        text = get_text("asf_configs_error", lang)
+    await message.reply_text(text, reply_markup=get_main_keyboard(context))
+
+@restricted
+async def choose_asf_export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sends ASF configs of the kind chosen after the template"""
+    query = update.callback_query
+    await query.answer()
+    lang = get_user_language(context)
+    
+    template = context.user_data.pop('asf_template', None)
+    if template is None:
+        await query.edit_message_text(get_text("asf_template_expired", lang))
+        return
+    template_content, account_filter = template
+    
+    delta = query.data == "asf_export_delta"
+    await query.edit_message_text(get_text("asf_delta_chosen" if delta else "asf_full_chosen", lang))
+    
+    try:
+        await send_asf_configs(query.message, context, template_content, delta, account_filter)
+    except Exception as e:
+        logging.error(f"Error exporting ASF configs: {e}")
+        await query.message.reply_text(
+            get_text("asf_configs_error", lang),
+            reply_markup=get_main_keyboard(context)
+        )
\ No newline at end of file
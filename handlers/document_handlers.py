@@ -1,14 +1,17 @@
 import logging
 import json
-from telegram import Update, InputFile
+from functools import partial
+from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from utils.decorators import restricted
 from utils.message_formatter import format_account_message, get_main_keyboard
-from utils.account_manager import process_mafile, save_processed_account, process_data_line
+from utils.account_manager import process_mafile, IMPORT_NEW, IMPORT_MERGED, IMPORT_REJECTED
+from utils.async_store import async_store
 from utils.localization import get_text, get_user_language
-from utils.zip_processor import process_zip_archive
-from utils.file_handlers import create_asf_configs_zip
+from utils.uploads import download_document, UploadTooLarge, MAX_UPLOAD_SIZE
+from utils.import_jobs import import_jobs
 from handlers.command_handlers import MAIN_MENU, WAITING_FOR_TEMPLATE
+from handlers.asf_handlers import offer_asf_export
 
 @restricted
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -17,14 +20,36 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     file_name = document.file_name.lower() if document.file_name else ""
     lang = get_user_language(context)
     
+    # Download the file into a temporary file
+    try:
+        upload = await download_document(context.bot, document)
+    except UploadTooLarge:
+        await update.message.reply_text(
+            get_text("file_too_large", lang, MAX_UPLOAD_SIZE // (1024 * 1024)),
+            reply_markup=get_main_keyboard(context)
+        )
+        return MAIN_MENU
+    
+    # Archives and account lists are imported by a background job, which closes the file when it is done
+    if file_name.endswith('.zip'):
+        return await start_import_job(update, context, upload, async_store.import_zip)
+    if file_name.endswith(('.txt', '.csv')):
+        return await start_import_job(update, context, upload, partial(async_store.import_text_file, name=file_name))
+    
+    # Temporary file is deleted when processing is finished, even on errors
+    try:
+        return await process_document(update, context, file_name, upload)
+    finally:
+        upload.close()
+
+async def process_document(update: Update, context: ContextTypes.DEFAULT_TYPE, file_name, upload) -> int:
+    """Processes downloaded document by its type"""
+    lang = get_user_language(context)
+    
     # Check if the user is in the ASF template waiting state
     user_data = context.user_data
     current_state = user_data.get('state')
     
-    # Get the file
-    file = await context.bot.get_file(document.file_id)
-    file_bytes = await file.download_as_bytearray()
-    
     # If user is in the ASF template waiting state and uploads a .json file,
     # process it as an ASF config template
     if current_state == WAITING_FOR_TEMPLATE and file_name.endswith('.json'):
@@ -33,24 +58,10 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         try:
             # Check that the file is valid JSON
-            template_content = file_bytes.decode('utf-8')
+            template_content = upload.read().decode('utf-8')
             json.loads(template_content)
             
-            # Create ZIP archive with configs
-            zip_data = create_asf_configs_zip(template_content)
-            
-            if zip_data:
-                # Send archive to the user
-                await update.message.reply_document(
-                    document=InputFile(zip_data, filename="asf_configs.zip"),
-                    caption=get_text("asf_configs_generated", lang),
-                    reply_markup=get_main_keyboard(context)
-                )
-            else:
-                await update.message.reply_text(
-                    get_text("asf_configs_error", lang),
-                    reply_markup=get_main_keyboard(context)
-                )
+            await offer_asf_export(update.message, context, template_content)
         except UnicodeDecodeError:
             await update.message.reply_text(
                 get_text("encoding_error", lang),
@@ -73,6 +84,7 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Check file type for normal processing
     if file_name.endswith('.mafile'):
         # Process maFile
+        file_bytes = upload.read()
         try:
             content = file_bytes.decode('utf-8')
         except UnicodeDecodeError:
@@ -90,7 +102,7 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         if account_data:
             # Save account data
-            saved_data = save_processed_account(account_data)
+            saved_data = await async_store.save_processed_account(account_data)
             
             # Send message with account data
             await update.message.reply_text(
@@ -104,46 +116,6 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 reply_markup=get_main_keyboard(context)
             )
     
-    elif file_name.endswith('.zip'):
-        # Process ZIP archive
-        processed_accounts, processed_mafiles, errors = process_zip_archive(file_bytes)
-        
-        # Counters for statistics
-        accounts_count = 0
-        mafiles_count = 0
-        
-        # Process accounts from accounts.txt
-        for line in processed_accounts:
-            account_data = process_data_line(line)
-            if account_data:
-                save_processed_account(account_data)
-                accounts_count += 1
-        
-        # Process maFiles
-        for mafile_content in processed_mafiles:
-            account_data = process_mafile(mafile_content)
-            if account_data:
-                save_processed_account(account_data)
-                mafiles_count += 1
-        
-        # Create results message
-        result_message = get_text("zip_processed", lang) + "\n\n"
-        result_message += get_text("accounts_processed", lang, accounts_count) + "\n"
-        result_message += get_text("mafiles_processed", lang, mafiles_count) + "\n"
-        
-        if errors:
-            result_message += "\n" + get_text("errors_processing", lang) + "\n"
-            for error in errors[:5]:  # Show only first 5 errors
-                result_message += f"- {error}\n"
-            
-            if len(errors) > 5:
-                result_message += get_text("more_errors", lang, len(errors) - 5)
-        
-        await update.message.reply_text(
-            result_message,
-            reply_markup=get_main_keyboard(context)
-        )
-    
     else:
         # Unknown file type
         await update.message.reply_text(
@@ -151,4 +123,90 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             reply_markup=get_main_keyboard(context)
         )
     
-    return MAIN_MENU 
\ No newline at end of file
+    return MAIN_MENU
+
+def format_import_result(stats, lang, title="zip_processed"):
+    """Formatting message with results of ZIP, text file or pasted lines import"""
+    if stats.already_imported:
+        return get_text("zip_already_imported", lang)
+    
+    # Create results message
+    result_message = get_text("import_cancelled" if stats.cancelled else title, lang) + "\n\n"
+    result_message += get_text("accounts_processed", lang, stats.accounts) + "\n"
+    if stats.mafiles:
+        result_message += get_text("mafiles_processed", lang, stats.mafiles) + "\n"
+    result_message += get_text(
+        "import_outcomes",
+        lang,
+        stats.outcomes[IMPORT_NEW],
+        stats.outcomes[IMPORT_MERGED],
+        stats.outcomes[IMPORT_REJECTED]
+    ) + "\n"
+    if stats.skipped:
+        result_message += get_text("import_skipped", lang, stats.skipped) + "\n"
+    
+    if stats.errors:
+        result_message += "\n" + get_text("errors_processing", lang) + "\n"
+        for error in stats.errors[:5]:  # Show only first 5 errors
+            result_message += f"- {error}\n"
+        
+        if stats.error_count > 5:
+            result_message += get_text("more_errors", lang, stats.error_count - 5)
+    
+    return result_message
+
+async def start_import_job(update: Update, context: ContextTypes.DEFAULT_TYPE, upload, import_upload) -> int:
+    """Starts background job importing uploaded file, progress is shown in one edited message.
+
+    import_upload is the AsyncAccountStore method importing this kind of file.
+    """
+    lang = get_user_language(context)
+    document = update.message.document
+    job = import_jobs.new_job(update.effective_chat.id, document.file_name)
+    
+    try:
+        job.message = await update.message.reply_text(
+            get_text("import_job_started", lang, job.id),
+            reply_markup=get_main_keyboard(context)
+        )
+    except Exception:
+        upload.close()
+        raise
+    
+    async def run(job):
+        try:
+            # Stream the file into storage in batches
+            return await import_upload(
+                upload,
+                file_unique_id=document.file_unique_id,
+                stats=job.stats,
+                cancel=job.cancel_event
+            )
+        finally:
+            upload.close()
+    
+    async def report(job):
+        stats = job.stats
+        await job.message.edit_text(get_text(
+            "import_progress",
+            lang,
+            job.id,
+            stats.processed,
+            stats.outcomes[IMPORT_NEW],
+            stats.outcomes[IMPORT_MERGED],
+            stats.error_count,
+            job.elapsed
+        ))
+    
+    async def finish(job, stats):
+        if stats is None:
+            await job.message.edit_text(get_text("import_failed", lang, job.id))
+        else:
+            await job.message.edit_text(format_import_result(
+                stats,
+                lang,
+                "zip_processed" if document.file_name.lower().endswith('.zip') else "text_processed"
+            ))
+    
+    import_jobs.start(job, run, report, finish)
+    return MAIN_MENU
\ No newline at end of file
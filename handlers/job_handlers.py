@@ -0,0 +1,44 @@
+import logging
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.ext import ContextTypes
+from utils.decorators import restricted
+from utils.import_jobs import import_jobs
+from utils.localization import get_text, get_user_language
+
+@restricted
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handler for /jobs command: lists running imports with cancel buttons"""
+    lang = get_user_language(context)
+    jobs = import_jobs.running(update.effective_chat.id)
+
+    if not jobs:
+        await update.message.reply_text(get_text("jobs_empty", lang))
+        return
+
+    # One line and one cancel button for each job
+    jobs_text = get_text("jobs_title", lang) + "\n"
+    keyboard = []
+    for job in jobs:
+        jobs_text += get_text("job_item", lang, job.id, job.name, job.stats.processed, job.elapsed) + "\n"
+        keyboard.append([InlineKeyboardButton(get_text("btn_cancel_job", lang, job.id), callback_data=f"cancel_job_{job.id}")])
+
+    await update.message.reply_text(jobs_text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+@restricted
+async def cancel_job(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Cancels import job selected in /jobs list"""
+    query = update.callback_query
+    await query.answer()
+    lang = get_user_language(context)
+
+    # Extract job ID from callback_data
+    job_id = int(query.data.rsplit("_", 1)[1])
+
+    job = import_jobs.get(job_id)
+    if job is None:
+        await query.edit_message_text(get_text("job_not_found", lang, job_id))
+        return
+
+    job.cancel()
+    logging.info(f"Import job {job_id} cancelled by user {update.effective_user.id}")
+    await query.edit_message_text(get_text("job_cancelling", lang, job_id))
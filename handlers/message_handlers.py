@@ -4,12 +4,14 @@ from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from utils.decorators import restricted
 from utils.message_formatter import format_account_message, get_main_keyboard
-from utils.account_manager import process_data_line, save_processed_account
+from utils.account_manager import process_data_line
+from utils.async_store import async_store
 from utils.localization import get_text, get_user_language
 from handlers.command_handlers import MAIN_MENU, ACCOUNT_LIST, WAITING_FOR_TEMPLATE
 from handlers.account_handlers import show_account_list, download_all_accounts, confirm_clear_all
 from handlers.language_handlers import show_language_menu
 from handlers.asf_handlers import start_asf_config_generation
+from handlers.document_handlers import format_import_result
 
 @restricted
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -48,12 +50,21 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     elif text == get_text("btn_asf_configs", lang):
         return await start_asf_config_generation(update, context)
     
+    # Pasted block of several lines is imported in batches like a .txt file
+    if '\n' in text:
+        stats = await async_store.import_text(text)
+        await update.message.reply_text(
+            format_import_result(stats, lang, "text_processed"),
+            reply_markup=get_main_keyboard(context)
+        )
+        return MAIN_MENU
+    
     # If the text is not a command, try to process it as account data
     account_data = process_data_line(text)
     
     if account_data:
         # Save account data
-        saved_data = save_processed_account(account_data)
+        saved_data = await async_store.save_processed_account(account_data)
         
         # Send message with account data
         await update.message.reply_text(
@@ -36,7 +36,14 @@ from handlers.account_handlers import (
 from handlers.message_handlers import handle_text
 from handlers.document_handlers import handle_document
 from handlers.language_handlers import show_language_menu, change_language
-from handlers.asf_handlers import process_asf_template
+from handlers.asf_handlers import process_asf_template, choose_asf_export, start_asf_config_generation
+from handlers.job_handlers import jobs_command, cancel_job
+from utils.account_store import account_store
+from utils.account_manager import deduplicate_accounts
+from utils.mafile_writer import mafile_writer
+from utils.async_store import shutdown_io
+from utils.process_pool import shutdown_process_pool
+from utils.import_jobs import import_jobs
 
 # Logging setup
 logging.basicConfig(
@@ -44,10 +51,35 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+async def post_init(application: Application) -> None:
+    """Starting storage writer on the bot's event loop"""
+    account_store.start_writer()
+
+async def post_shutdown(application: Application) -> None:
+    """Writing remaining storage changes before exit"""
+    # Running imports stop after their current batch
+    await import_jobs.stop()
+    shutdown_io()
+    shutdown_process_pool()
+    await account_store.stop_writer()
+    if mafile_writer is not None:
+        mafile_writer.close()
+
 def main() -> None:
     """Bot startup"""
+    # Open accounts storage once, handlers read it through the store
+    account_store.load()
+    deduplicate_accounts()
+    account_store.collect_garbage()
+    
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Common handlers for all states
     common_handlers = [
@@ -74,7 +106,11 @@ def main() -> None:
 
     # Create conversation handler
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
+        # /asf starts the conversation too, so the template it asks for is handled without /start
+        entry_points=[
+            CommandHandler("start", start),
+            CommandHandler("asf", start_asf_config_generation)
+        ],
         states={
             MAIN_MENU: [
                 *common_handlers,
@@ -114,7 +150,9 @@ def main() -> None:
         fallbacks=[
             CommandHandler("start", start),
             CommandHandler("help", help_command),
-            CommandHandler("config", config_command)
+            CommandHandler("config", config_command),
+            CommandHandler("download", download_all_accounts),
+            CommandHandler("asf", start_asf_config_generation)
         ],
         name="account_manager_conversation",
         persistent=False,
@@ -124,9 +162,16 @@ def main() -> None:
     # Add handlers
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("config", config_command))
+    application.add_handler(CommandHandler("download", download_all_accounts))
+    application.add_handler(CommandHandler("jobs", jobs_command))
+    application.add_handler(CallbackQueryHandler(cancel_job, pattern="^cancel_job_"))
+    application.add_handler(CallbackQueryHandler(choose_asf_export, pattern="^asf_export_"))
 
     # Start the bot
     application.run_polling(allowed_updates=Update.ALL_TYPES)
+    
+    # Close accounts storage after the bot is stopped
+    account_store.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,53 @@
+import unittest
+from utils.line_parser import parse_account_line, parse_accounts_text
+
+class ParseAccountLineTest(unittest.TestCase):
+    """Lines that are not account data must not be stored as accounts"""
+
+    def test_rejects_text_with_colon(self):
+        self.assertIsNone(parse_account_line("Hello: how are you"))
+
+    def test_rejects_empty_password(self):
+        self.assertIsNone(parse_account_line("user:"))
+        self.assertIsNone(parse_account_line("user:   "))
+
+    def test_rejects_url(self):
+        self.assertIsNone(parse_account_line("https://steamcommunity.com/profiles/123"))
+
+    def test_rejects_text_lines_of_buffer(self):
+        records, rejected = parse_accounts_text("user:pass\nNote: see below\nuser2:")
+        self.assertEqual([line_number for line_number, account_data in records], [1])
+        self.assertEqual(rejected, [2, 3])
+
+    def test_absent_mail_is_missing(self):
+        account_data = parse_account_line("user:pass")
+        self.assertEqual((account_data['login'], account_data['password']), ("user", "pass"))
+        self.assertEqual((account_data['mail'], account_data['mail_password']), ("missing", "missing"))
+
+    def test_link_line(self):
+        account_data = parse_account_line("user:pass:https://steamcommunity.com/profiles/76561198000000000")
+        self.assertEqual(account_data['steam_id'], "76561198000000000")
+        self.assertEqual(account_data['mail'], "missing")
+
+    def test_semicolon_in_password_does_not_switch_delimiter(self):
+        account_data = parse_account_line("user:pa;ss:mail@x.com:mp")
+        self.assertEqual((account_data['login'], account_data['password']), ("user", "pa;ss"))
+        self.assertEqual((account_data['mail'], account_data['mail_password']), ("mail@x.com", "mp"))
+
+    def test_semicolon_in_mail_password_keeps_steam_id(self):
+        account_data = parse_account_line("user:pass:mail@x.com:m;p:https://steamcommunity.com/profiles/76561198000000000")
+        self.assertEqual(account_data['mail_password'], "m;p")
+        self.assertEqual(account_data['steam_id'], "76561198000000000")
+
+    def test_semicolon_delimited_lines(self):
+        records, rejected = parse_accounts_text("u1;p:1;m1@x.com;mp1\nu2;p2\nu3;p3;https://steamcommunity.com/profiles/765\n")
+        self.assertEqual(rejected, [])
+        self.assertEqual([account_data['password'] for line_number, account_data in records], ["p:1", "p2", "p3"])
+        self.assertEqual(records[2][1]['steam_id'], "765")
+
+    def test_full_line(self):
+        account_data = parse_account_line("user:pass:user@mail.com:mailpass")
+        self.assertEqual((account_data['mail'], account_data['mail_password']), ("user@mail.com", "mailpass"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+from utils.blob_store import FileBlobStore
+from utils.snapshot_backend import SnapshotBackend
+
+def account(login, **fields):
+    return {'login': login, 'password': "pass", 'mail': f"{login}@mail.com", **fields}
+
+class SnapshotBackendTest(unittest.TestCase):
+    """Accounts must be read back from the snapshot whatever state its index file is in"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "accounts.jsonl")
+        self.blobs = FileBlobStore(os.path.join(directory.name, "blobs"))
+
+    def open_backend(self):
+        backend = SnapshotBackend(self.path, self.blobs, 1024 * 1024, 16)
+        backend.load()
+        self.addCleanup(backend.close)
+        return backend
+
+    def write_snapshot(self, items):
+        """Writes accounts to a new snapshot and closes the backend, so only the snapshot is read on load"""
+        backend = self.open_backend()
+        backend.upsert_many(items)
+        backend.compact()
+        backend.close()
+        return backend
+
+    def assert_accounts(self, backend, expected):
+        self.assertEqual(list(backend.items()), expected)
+        for key, account_data in expected:
+            self.assertEqual(backend.find_key('login', account_data['login']), key)
+
+    def test_compaction_then_reload(self):
+        items = [(f"user{i}", account(f"user{i}")) for i in range(100)]
+        backend = self.write_snapshot(items)
+        self.assertEqual(os.path.getsize(backend.journal_path), 0)
+
+        backend = self.open_backend()
+        self.assert_accounts(backend, items)
+        self.assertEqual(backend.page(10, 5), items[10:15])
+
+        # Changes after the snapshot are replayed from the journal on top of it
+        backend.upsert_many([("user3", account("user3", password="changed"))], deletes=("user5",))
+        backend.close()
+        backend = self.open_backend()
+        self.assertEqual(backend.get("user3")['password'], "changed")
+        self.assertFalse(backend.contains("user5"))
+        self.assertEqual(backend.count(), 99)
+
+    def test_missing_index_is_rebuilt(self):
+        items = [(f"user{i}", account(f"user{i}")) for i in range(20)]
+        backend = self.write_snapshot(items)
+        os.remove(backend.index_path)
+
+        backend = self.open_backend()
+        self.assert_accounts(backend, items)
+        self.assertTrue(os.path.exists(backend.index_path))
+
+    def test_stale_index_is_rebuilt(self):
+        backend = self.write_snapshot([(f"user{i}", account(f"user{i}")) for i in range(20)])
+        old_index = f"{self.path}.idx.old"
+        shutil.copy(backend.index_path, old_index)
+
+        items = [(f"user{i}", account(f"user{i}")) for i in range(10, 40)]
+        backend = self.open_backend()
+        backend.clear()
+        backend.upsert_many(items)
+        backend.compact()
+        backend.close()
+        # Index of the previous snapshot points at wrong offsets of this one
+        os.replace(old_index, backend.index_path)
+
+        backend = self.open_backend()
+        self.assert_accounts(backend, items)
+        self.assertIsNone(backend.find_key('login', "user0"))
+
+    def test_damaged_index_is_rebuilt(self):
+        items = [(f"user{i}", account(f"user{i}")) for i in range(20)]
+        backend = self.write_snapshot(items)
+        with open(backend.index_path, 'w') as f:
+            f.write('{"snapshot":')
+
+        backend = self.open_backend()
+        self.assert_accounts(backend, items)
+
+    def test_collect_garbage_keeps_referenced_blobs(self):
+        refs = [self.blobs.put({'account_name': f"user{i}"}) for i in range(3)]
+        self.blobs.sync()
+        self.write_snapshot([(f"user{i}", account(f"user{i}", mafile_ref=refs[i])) for i in range(3)])
+
+        backend = self.open_backend()
+        # Reference of a record changed since the snapshot is kept from the record, not its old line
+        backend.upsert_many([("user1", account("user1"))])
+        self.assertEqual(backend.collect_garbage(), 0)
+        backend.compact()
+        backend.close()
+
+        backend = self.open_backend()
+        self.assertEqual(backend.collect_garbage(), 1)
+        self.assertEqual(self.blobs.get_body(refs[0]), '{"account_name":"user0"}')
+        self.assertEqual(self.blobs.get_body(refs[2]), '{"account_name":"user2"}')
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+from utils.blob_store import FileBlobStore
+from utils.storage_backends import JournalBackend
+
+def account(login):
+    return {'login': login, 'password': "pass", 'mail': f"{login}@mail.com"}
+
+class JournalBackendTest(unittest.TestCase):
+    """Accounts written to the journal must survive a restart, a torn last record and compaction"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "accounts.json")
+        self.blobs = FileBlobStore(os.path.join(directory.name, "blobs"))
+
+    def open_backend(self, compact_size=1024 * 1024):
+        backend = JournalBackend(self.path, self.blobs, compact_size)
+        backend.load()
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_replay_after_restart(self):
+        backend = self.open_backend()
+        backend.upsert_many([("a", account("a")), ("b", account("b"))])
+        backend.upsert_many([("c", account("c"))], deletes=("b",))
+        backend.close()
+
+        backend = self.open_backend()
+        self.assertEqual(list(backend.keys()), ["a", "c"])
+        self.assertEqual(backend.get("c"), account("c"))
+        self.assertEqual(backend.find_key('login', "a"), "a")
+
+    def test_replay_skips_torn_last_record(self):
+        backend = self.open_backend()
+        backend.upsert_many([("a", account("a")), ("b", account("b"))])
+        backend.close()
+        with open(backend.journal_path, 'a') as f:
+            f.write('{"op":"put","key":"c","value":{"login":"c","pass')
+
+        backend = self.open_backend()
+        self.assertEqual(list(backend.keys()), ["a", "b"])
+
+        # Records written after the torn one are not glued to it
+        backend.upsert_many([("d", account("d"))])
+        backend.close()
+        backend = self.open_backend()
+        self.assertEqual(list(backend.keys()), ["a", "b", "d"])
+        self.assertEqual(backend.get("d"), account("d"))
+
+    def test_compaction_then_reload(self):
+        # Every few records rotate the journal and rewrite the snapshot
+        backend = self.open_backend(compact_size=300)
+        for i in range(50):
+            backend.upsert_many([(f"user{i}", account(f"user{i}"))])
+        for i in range(0, 50, 5):
+            backend.delete(f"user{i}")
+        backend.upsert_many([("user1", {**account("user1"), 'password': "changed"})])
+        backend.close()
+        self.assertFalse(os.path.exists(backend.rotated_path))
+
+        backend = self.open_backend(compact_size=300)
+        expected = [f"user{i}" for i in range(50) if i % 5]
+        self.assertEqual(sorted(backend.keys()), sorted(expected))
+        self.assertEqual(backend.get("user1")['password'], "changed")
+        self.assertIsNone(backend.get("user0"))
+
+    def test_rotated_journal_is_replayed(self):
+        backend = self.open_backend()
+        backend.upsert_many([("a", account("a"))])
+        backend.close()
+        # Process died during compaction: journal was rotated, snapshot not written yet
+        os.replace(backend.journal_path, backend.rotated_path)
+
+        backend = self.open_backend()
+        backend.upsert_many([("b", account("b"))])
+        backend.compact()
+        backend.close()
+        self.assertFalse(os.path.exists(backend.rotated_path))
+
+        backend = self.open_backend()
+        self.assertEqual(sorted(backend.keys()), ["a", "b"])
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
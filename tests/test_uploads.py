@@ -0,0 +1,48 @@
+import asyncio
+import importlib.util
+import io
+import types
+import unittest
+import zipfile
+
+# utils.uploads needs python-telegram-bot and the bot's config.py
+HAS_BOT_MODULES = all(importlib.util.find_spec(name) for name in ('telegram', 'config'))
+
+class _File:
+    def __init__(self, data):
+        self._data = data
+
+    async def download_to_memory(self, out):
+        out.write(self._data)
+
+class _Bot:
+    def __init__(self, data):
+        self._data = data
+
+    async def get_file(self, file_id):
+        return _File(self._data)
+
+@unittest.skipUnless(HAS_BOT_MODULES, "python-telegram-bot and config.py are required")
+class DownloadDocumentTest(unittest.TestCase):
+    """Downloaded uploads must be readable by zipfile on every supported Python"""
+
+    def test_zip_upload_is_read_by_zipfile(self):
+        from utils.uploads import download_document
+        from utils.zip_processor import iter_zip_archive, ZIP_LINE
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('accounts.txt', "user:pass:user@mail.com:mailpass\n")
+        data = archive.getvalue()
+        document = types.SimpleNamespace(file_id="file", file_size=len(data))
+
+        upload = asyncio.run(download_document(_Bot(data), document))
+        try:
+            self.assertTrue(upload.seekable())
+            items = list(iter_zip_archive(upload))
+        finally:
+            upload.close()
+        self.assertIn((ZIP_LINE, "accounts.txt:1", "user:pass:user@mail.com:mailpass"), items)
+
+if __name__ == '__main__':
+    unittest.main()
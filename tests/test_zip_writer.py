@@ -0,0 +1,164 @@
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+# utils.zip_writer and utils.file_handlers need the bot's config.py
+HAS_CONFIG = importlib.util.find_spec('config') is not None
+
+def read_archive(data):
+    """Returns {name: (compress type, content)} of archive, checking CRCs of all entries"""
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        if zip_file.testzip() is not None:
+            raise AssertionError(f"Bad CRC of {zip_file.testzip()}")
+        return {
+            info.filename: (info.compress_type, zip_file.read(info))
+            for info in zip_file.infolist()
+        }
+
+@unittest.skipUnless(HAS_CONFIG, "config.py is required")
+class ZipAssemblerTest(unittest.TestCase):
+    """Archives written by ZipAssembler must be read back by zipfile unchanged"""
+
+    def assemble(self, entries, streams=()):
+        from utils.zip_writer import ZipAssembler
+
+        out = io.BytesIO()
+        with ZipAssembler(out) as archive:
+            for name, data in entries:
+                archive.add(name, data)
+            for name, data in streams:
+                archive.add_stream(name, io.BytesIO(data), len(data))
+        return out.getvalue()
+
+    def test_round_trip(self):
+        entries = [
+            ("small.txt", b"tiny"),
+            ("text.json", "{\"key\": \"value\"}" * 200),
+            ("random.bin", os.urandom(4096)),
+            ("mafile/логин.maFile", "{\"account_name\": \"логин\"}"),
+            ("empty.txt", b""),
+        ]
+        streams = [("accounts.txt", b"user:pass:mail@x.com:mp\n" * 5000)]
+        archive = read_archive(self.assemble(entries, streams))
+
+        self.assertEqual(list(archive), [name for name, data in entries + streams])
+        for name, data in entries + streams:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            self.assertEqual(archive[name][1], data)
+        self.assertEqual(archive["small.txt"][0], zipfile.ZIP_STORED)
+        self.assertEqual(archive["random.bin"][0], zipfile.ZIP_STORED)
+        self.assertEqual(archive["text.json"][0], zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive["accounts.txt"][0], zipfile.ZIP_DEFLATED)
+
+    def test_windows_keep_order(self):
+        entries = [(f"{i}.json", f"{{\"n\": {i}, \"pad\": \"{'x' * 100}\"}}") for i in range(250)]
+        with mock.patch('utils.zip_writer.ZIP_PARALLEL_THRESHOLD', 16):
+            archive = read_archive(self.assemble(entries))
+        self.assertEqual(list(archive), [name for name, data in entries])
+        self.assertEqual([content for compress_type, content in archive.values()], [data.encode('utf-8') for name, data in entries])
+
+    def test_zip64_entry_count(self):
+        count = 0x10000 + 10
+        entries = [(f"{i}.txt", str(i)) for i in range(count)]
+        data = self.assemble(entries, [("accounts.txt", b"line\n" * 100)])
+        # ZIP64 end of central directory record is written before the locator and the end record
+        self.assertIn(b'PK\x06\x06', data[-200:])
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            infos = zip_file.infolist()
+            self.assertEqual(len(infos), count + 1)
+            self.assertEqual(zip_file.read(infos[0x10000]), str(0x10000).encode('ascii'))
+            self.assertEqual(zip_file.read("accounts.txt"), b"line\n" * 100)
+
+    def test_size_bound_is_not_exceeded(self):
+        from utils.zip_writer import ZipAssembler
+
+        out = io.BytesIO()
+        with ZipAssembler(out) as archive:
+            archive.add("random.bin", os.urandom(10000))
+            archive.add("text.txt", "abc" * 1000)
+            bound = archive.size_bound() + ZipAssembler.entry_size_bound("stream.bin", 5000, streamed=True)
+            archive.add_stream("stream.bin", io.BytesIO(os.urandom(5000)), 5000)
+        self.assertLessEqual(len(out.getvalue()), bound)
+
+@unittest.skipUnless(HAS_CONFIG, "config.py is required")
+class ExportPartsTest(unittest.TestCase):
+    """Split exports must be complete archives under the part size with every account in one part"""
+
+    def setUp(self):
+        from utils.account_store import AccountStore
+        from utils.blob_store import FileBlobStore
+        from utils.storage_backends import JsonBackend
+
+        self.directory = tempfile.TemporaryDirectory()
+        backend = JsonBackend(os.path.join(self.directory.name, "accounts.json"), FileBlobStore(os.path.join(self.directory.name, "blobs")))
+        backend.load()
+        self.store = AccountStore(backend)
+        patcher = mock.patch('utils.file_handlers.account_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def export_parts(self, part_size):
+        from utils.file_handlers import iter_export_parts
+
+        def account_entries(account_data):
+            return [(f"mafile/{account_data['login']}.maFile", account_data['body'])]
+
+        def account_line(account_data):
+            return f"{account_data['login']}:{account_data['password']}\n"
+
+        parts = []
+        for part in iter_export_parts(account_entries, account_line, part_size):
+            with part:
+                parts.append(part.read())
+        return parts
+
+    def test_parts_stay_under_part_size(self):
+        part_size = 20000
+        # Hex of random bytes compresses to about half, so parts are filled close to the budget
+        accounts = [(f"user{i}", {'login': f"user{i}", 'password': "pass", 'body': os.urandom(600).hex()}) for i in range(100)]
+        self.store.upsert_many(accounts)
+
+        parts = self.export_parts(part_size)
+        self.assertGreater(len(parts), 1)
+
+        exported = []
+        for data in parts:
+            self.assertLessEqual(len(data), part_size)
+            archive = read_archive(data)
+            lines = archive.pop("accounts.txt")[1].decode('utf-8').splitlines()
+            logins = [line.split(":")[0] for line in lines]
+            # Every account of accounts.txt has its maFile in the same part
+            self.assertEqual(list(archive), [f"mafile/{login}.maFile" for login in logins])
+            exported.extend(logins)
+        self.assertEqual(exported, [key for key, account_data in accounts])
+
+    def test_account_larger_than_part_size_gets_own_part(self):
+        part_size = 20000
+        self.store.upsert_many([
+            ("small", {'login': "small", 'password': "pass", 'body': "x"}),
+            ("large", {'login': "large", 'password': "pass", 'body': os.urandom(30000).hex()}),
+            ("after", {'login': "after", 'password': "pass", 'body': "y"}),
+        ])
+
+        parts = [read_archive(data) for data in self.export_parts(part_size)]
+        self.assertEqual([sorted(archive) for archive in parts], [
+            ["accounts.txt", "mafile/small.maFile"],
+            ["accounts.txt", "mafile/large.maFile"],
+            ["accounts.txt", "mafile/after.maFile"],
+        ])
+
+    def test_single_archive_without_part_size(self):
+        self.store.upsert_many([(f"user{i}", {'login': f"user{i}", 'password': "pass", 'body': os.urandom(600).hex()}) for i in range(100)])
+        parts = self.export_parts(None)
+        self.assertEqual(len(parts), 1)
+        self.assertEqual(len(read_archive(parts[0])), 101)
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
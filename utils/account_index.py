@@ -0,0 +1,298 @@
+import re
+import threading
+
+# Fields filters can check for a value (mafile is true for accounts with a maFile)
+FILTER_FIELDS = ('login', 'password', 'mail', 'mail_password', 'r_code', 'steam_id', 'link', 'mafile')
+
+# Words of filter expressions: parentheses, operators and predicates like has:mafile
+FILTER_TOKEN = re.compile(r'\s*(?:(\()|(\))|([^\s()]+))')
+
+class FilterError(ValueError):
+    """Filter expression could not be parsed"""
+
+def has_value(account_data, field):
+    """Checks if account has a value of the field, "missing" and empty values do not count"""
+    if field == 'mafile':
+        return bool(account_data.get('mafile_ref') or account_data.get('mafile'))
+    value = account_data.get(field)
+    return bool(value) and value != "missing"
+
+def mail_domain(account_data):
+    """Returns lowercased domain of account mail or None"""
+    if not has_value(account_data, 'mail') or '@' not in account_data['mail']:
+        return None
+    return account_data['mail'].rsplit('@', 1)[1].strip().lower()
+
+def parse_filter(text):
+    """
+    Parsing filter expression.
+
+    Predicates are has:FIELD, missing:FIELD and domain:DOMAIN (domain of mail),
+    FIELD is one of FILTER_FIELDS. They are combined with not, and, or
+    (in order of precedence) and parentheses, predicates next to each other
+    are joined with and. Example: has:mafile and (domain:gmail.com or missing:mail)
+
+    Returns:
+        tuple: expression tree of ('has', field), ('domain', domain),
+        ('not', node), ('and', left, right) and ('or', left, right) nodes
+
+    Raises:
+        FilterError: if the expression is not valid
+    """
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = FILTER_TOKEN.match(text, position)
+        tokens.append(match.group(match.lastindex))
+        position = match.end()
+    if not tokens:
+        raise FilterError("Filter is empty")
+
+    parser = _FilterParser(tokens)
+    node = parser.parse_or()
+    if parser.peek() is not None:
+        raise FilterError(f"Unexpected {parser.peek()!r}")
+    return node
+
+def format_filter(node):
+    """Returns canonical text of parsed filter, the same for equivalent spellings"""
+    op = node[0]
+    if op == 'has':
+        return f"has:{node[1]}"
+    if op == 'domain':
+        return f"domain:{node[1]}"
+    if op == 'not':
+        if node[1][0] == 'has':
+            return f"missing:{node[1][1]}"
+        return f"not {_format_operand(node[1], 'not')}"
+    return f" {op} ".join(_format_operand(operand, op) for operand in node[1:])
+
+def _format_operand(node, parent):
+    # Parentheses are kept only where precedence needs them
+    text = format_filter(node)
+    if node[0] == 'or' and parent != 'or' or node[0] == 'and' and parent == 'not':
+        return f"({text})"
+    return text
+
+def normalize_filter(text):
+    """Returns canonical text of filter expression, raises FilterError if it is not valid"""
+    return format_filter(parse_filter(text))
+
+def filter_from_args(args):
+    """Returns canonical filter given as command arguments or None if there are none"""
+    if not args:
+        return None
+    return normalize_filter(" ".join(args))
+
+class _FilterParser:
+    """Recursive descent parser over filter tokens"""
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._position = 0
+
+    def peek(self):
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _next(self):
+        token = self.peek()
+        if token is None:
+            raise FilterError("Filter ends unexpectedly")
+        self._position += 1
+        return token
+
+    def parse_or(self):
+        node = self._parse_and()
+        while (self.peek() or '').lower() == 'or':
+            self._next()
+            node = ('or', node, self._parse_and())
+        return node
+
+    def _parse_and(self):
+        node = self._parse_not()
+        while True:
+            token = self.peek()
+            if token is None or token == ')' or token.lower() == 'or':
+                return node
+            if token.lower() == 'and':
+                self._next()
+            node = ('and', node, self._parse_not())
+
+    def _parse_not(self):
+        if (self.peek() or '').lower() == 'not':
+            self._next()
+            return ('not', self._parse_not())
+        return self._parse_term()
+
+    def _parse_term(self):
+        token = self._next()
+        if token == '(':
+            node = self.parse_or()
+            if self._next() != ')':
+                raise FilterError("Missing )")
+            return node
+        if token == ')' or token.lower() in ('and', 'or'):
+            raise FilterError(f"Unexpected {token!r}")
+
+        name, colon, value = token.partition(':')
+        name = name.lower()
+        if name in ('has', 'missing'):
+            field = value.lower()
+            if field not in FILTER_FIELDS:
+                raise FilterError(f"Unknown field {value!r}")
+            return ('has', field) if name == 'has' else ('not', ('has', field))
+        if name == 'domain' and value.lstrip('@'):
+            return ('domain', value.lstrip('@').lower())
+        raise FilterError(f"Unknown filter {token!r}")
+
+def set_bit(bits, slot):
+    """Adding slot to bitset kept in bytearray, growing it if needed"""
+    index = slot >> 3
+    if index >= len(bits):
+        bits.extend(bytes(index + 1 - len(bits)))
+    bits[index] |= 1 << (slot & 7)
+
+def clear_bit(bits, slot):
+    """Removing slot from bitset kept in bytearray"""
+    index = slot >> 3
+    if index < len(bits):
+        bits[index] &= ~(1 << (slot & 7))
+
+def bits_to_int(bits):
+    """Returns bitset as int with bit N set for slot N, for fast set operations"""
+    return int.from_bytes(bits, 'little')
+
+class AccountIndex:
+    """
+    Bitset indexes of account fields for filtered exports.
+
+    Every account gets a slot number, freed slots are reused.
+    For every field of FILTER_FIELDS a bitset holds slots of accounts having
+    a value of it, and for every mail domain a bitset holds slots of accounts
+    with mail on it. Bitsets are bytearrays changed in place on every update,
+    a filter is evaluated with bitwise operations on them converted to ints,
+    so matching accounts are found without reading any record.
+    Records must have their maFile externalized (mafile_ref), as the store keeps them.
+    """
+
+    # Record fields checked for FILTER_FIELDS
+    RECORD_FIELDS = tuple('mafile_ref' if field == 'mafile' else field for field in FILTER_FIELDS)
+
+    def __init__(self):
+        # Held while the index is built, so changes made meanwhile wait for it
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._slots = {}
+        self._keys = []
+        self._domains_of = []
+        self._free = []
+        # Bitsets of live slots and of fields have the same length, grown together
+        self._live = bytearray()
+        self._fields = {field: bytearray() for field in FILTER_FIELDS}
+        self._field_bits = tuple(zip(self.RECORD_FIELDS, self._fields.values()))
+        self._domains = {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def update(self, items, deletes=()):
+        """Indexing (key, account) pairs, accounts with keys from deletes are removed first"""
+        with self.lock:
+            for key in deletes:
+                self._remove(key)
+            for key, account_data in items:
+                self._put(key, account_data)
+
+    def remove(self, key):
+        """Removing account from the index"""
+        with self.lock:
+            self._remove(key)
+
+    def clear(self):
+        """Removing all accounts"""
+        with self.lock:
+            self._reset()
+
+    def select(self, node):
+        """Returns keys of accounts matching parsed filter, in slot order"""
+        with self.lock:
+            matched = self._evaluate(node)
+            keys = []
+            # Bytes without matches are skipped at once
+            for index, byte in enumerate(matched.to_bytes((matched.bit_length() + 7) // 8, 'little')):
+                if byte:
+                    base = index << 3
+                    keys.extend(self._keys[base + bit] for bit in range(8) if byte >> bit & 1)
+            return keys
+
+    def _evaluate(self, node):
+        op = node[0]
+        if op == 'has':
+            return bits_to_int(self._fields[node[1]])
+        if op == 'domain':
+            bits = self._domains.get(node[1])
+            return bits_to_int(bits) if bits is not None else 0
+        if op == 'not':
+            return bits_to_int(self._live) & ~self._evaluate(node[1])
+        if op == 'and':
+            return self._evaluate(node[1]) & self._evaluate(node[2])
+        return self._evaluate(node[1]) | self._evaluate(node[2])
+
+    def _new_slot(self):
+        if self._free:
+            return self._free.pop()
+        slot = len(self._keys)
+        self._keys.append(None)
+        self._domains_of.append(None)
+        if slot >> 3 >= len(self._live):
+            # Capacity is doubled for all bitsets at once
+            grow = bytes(max(len(self._live), 64))
+            self._live.extend(grow)
+            for bits in self._fields.values():
+                bits.extend(grow)
+        return slot
+
+    def _put(self, key, account_data):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._new_slot()
+            self._slots[key] = slot
+            self._keys[slot] = key
+            set_bit(self._live, slot)
+
+        # Bits are set inline, this runs for every upserted account
+        index = slot >> 3
+        mask = 1 << (slot & 7)
+        for field, bits in self._field_bits:
+            value = account_data.get(field)
+            if value and value != "missing":
+                bits[index] |= mask
+            else:
+                bits[index] &= ~mask
+        self._set_domain(slot, mail_domain(account_data))
+
+    def _remove(self, key):
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        for bits in self._fields.values():
+            clear_bit(bits, slot)
+        self._set_domain(slot, None)
+        clear_bit(self._live, slot)
+        self._keys[slot] = None
+        self._free.append(slot)
+
+    def _set_domain(self, slot, domain):
+        old_domain = self._domains_of[slot]
+        if old_domain == domain:
+            return
+        if old_domain is not None:
+            clear_bit(self._domains[old_domain], slot)
+        if domain is not None:
+            set_bit(self._domains.setdefault(domain, bytearray()), slot)
+        self._domains_of[slot] = domain
\ No newline at end of file
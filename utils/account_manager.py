@@ -1,78 +1,40 @@
-import json
 import os
-import re
+import json
+import hashlib
 import logging
+from contextlib import nullcontext
+from itertools import islice
+import config
+from utils.account_store import account_store, record_key
+from utils.storage_backends import identity_values
+from utils.mafile_writer import queue_mafile_copy
+from utils.zip_processor import ZIP_LINE, ZIP_CSV_ROW, ZIP_MAFILE, ZIP_ERROR, CSV_ROW_DELIMITER, decode_text
+from utils.line_parser import parse_accounts_text, parse_account_line
+from utils.process_pool import process_map
 
-# Path to the accounts data file
-ACCOUNTS_FILE = 'accounts.json'
+# Outcomes of importing one record
+IMPORT_NEW = 'new'
+IMPORT_MERGED = 'merged'
+IMPORT_REJECTED = 'rejected'
 
-def load_accounts():
-    """Loading accounts data from file"""
-    if not os.path.exists(ACCOUNTS_FILE):
-        with open(ACCOUNTS_FILE, 'w') as f:
-            json.dump({}, f)
-        return {}
-    
-    try:
-        with open(ACCOUNTS_FILE, 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        logging.error(f"Error reading file {ACCOUNTS_FILE}. Creating new file.")
-        with open(ACCOUNTS_FILE, 'w') as f:
-            json.dump({}, f)
-        return {}
-
-def save_accounts(accounts):
-    """Saving accounts data to file"""
-    with open(ACCOUNTS_FILE, 'w') as f:
-        json.dump(accounts, f, indent=2)
-
-def extract_steamid_from_url(url: str) -> str:
-    """Extracting SteamID from Steam profile URL"""
-    if not url:
-        return ""
-    
-    # Looking for SteamID in URL like https://steamcommunity.com/profiles/76561198921334935
-    match = re.search(r'profiles/(\d+)', url)
-    if match:
-        return match.group(1)
-    return ""
-
-def store_account_data(account_data):
-    """Storing account data in file"""
-    accounts = load_accounts()
-    
-    # If there is SteamID, use it as key
-    if account_data.get('steam_id'):
-        key = account_data['steam_id']
-        accounts[key] = account_data
-        logging.info(f"Account with SteamID {key} added to storage")
-    # Otherwise use login as key
-    elif account_data.get('login'):
-        key = account_data['login']
-        accounts[key] = account_data
-        logging.info(f"Account with login {key} added to storage")
-    
-    # Save updated data
-    save_accounts(accounts)
-
-def find_matching_account(account_data):
-    """Finding matching account in storage"""
-    accounts = load_accounts()
-    
-    # If there is SteamID, search by it
-    if account_data.get('steam_id') and account_data['steam_id'] in accounts:
-        return accounts[account_data['steam_id']]
-    
-    # If there is login, search by it
-    if account_data.get('login') and account_data['login'] in accounts:
-        return accounts[account_data['login']]
-    
-    # If no matches, return None
-    return None
-
-def merge_account_data(existing_data, new_data):
-    """Merging account data"""
+# Number of records matched and written together by streaming import
+IMPORT_BATCH_SIZE = getattr(config, 'IMPORT_BATCH_SIZE', 1000)
+
+# Archives with at least this many maFiles are parsed in the shared process pool,
+# maFiles are sent to it in windows of this size
+MAFILE_PARALLEL_THRESHOLD = getattr(config, 'MAFILE_PARALLEL_THRESHOLD', 2000)
+
+# Number of error messages kept by streaming import (the rest are only counted)
+MAX_REPORTED_ERRORS = 100
+
+# Number of record fingerprints remembered for skipping unchanged records on re-import
+MAX_RECORD_FINGERPRINTS = getattr(config, 'MAX_RECORD_FINGERPRINTS', 500000)
+
+# Number of processed uploads remembered for skipping exact repeats
+MAX_REMEMBERED_UPLOADS = 100
+
+def merge_records(existing_data, new_data):
+    """Merging account data without saving it"""
     merged_data = existing_data.copy()
     
     # Update only those fields that exist in new data and are not empty
@@ -80,112 +42,427 @@ def merge_account_data(existing_data, new_data):
         if value and value != "missing":
             merged_data[key] = value
     
-    # Save updated data
-    accounts = load_accounts()
-    if merged_data.get('steam_id'):
-        accounts[merged_data['steam_id']] = merged_data
-    elif merged_data.get('login'):
-        accounts[merged_data['login']] = merged_data
-    save_accounts(accounts)
-    
     return merged_data
 
-def process_data_line(line: str) -> dict:
-    """Processing one line of data"""
-    parts = line.strip().split(':')
-    if len(parts) < 4:
+class AccountBatch:
+    """Accounts staged in memory before one write to storage.
+    
+    Lookups see staged accounts first and then storage, so records of one batch
+    are matched against each other and against stored accounts by any identity
+    (SteamID, login, maFile account name).
+    """
+    
+    def __init__(self, use_store=True):
+        self.staged = {}
+        self.deletes = set()
+        # Keys of changed accounts, a dict keeps them in the order they were imported
+        self.changed = {}
+        self._index = {}
+        self._use_store = use_store
+    
+    def get(self, key):
+        """Returns staged or stored account by key"""
+        if key in self.staged:
+            return self.staged[key]
+        if self._use_store and key not in self.deletes:
+            return account_store.get(key)
         return None
-        
-    login = parts[0]
-    password = parts[1]
-    mail = parts[2]
-    mail_password = parts[3]
-    
-    # Check for link (everything after the 4th element)
-    link = ':'.join(parts[4:]) if len(parts) > 4 else ""
-    
-    # Extract SteamID from link if present
-    steam_id = extract_steamid_from_url(link)
-    
-    # Create dictionary with account data
-    account_data = {
-        'login': login,
-        'password': password,
-        'mail': mail,
-        'mail_password': mail_password,
-        'r_code': "missing",
-        'steam_id': steam_id,
-        'link': link,
-        'mafile': {}
-    }
     
-    return account_data
-
-def process_mafile(content: str) -> dict:
-    """Processing maFile"""
-    try:
-        # Try to load JSON, regardless of formatting
-        mafile_data = json.loads(content)
+    def find(self, account_data):
+        """Returns (key, account) matching account_data or (None, None)"""
+        for identity in identity_values(account_data).items():
+            key = self._index.get(identity)
+            if key in self.staged:
+                return key, self.staged[key]
+        
+        if self._use_store:
+            key = account_store.find_key(account_data)
+            if key is not None and key not in self.deletes:
+                return key, self.get(key)
         
-        # Get values
-        account_name = mafile_data.get('account_name', "missing")
-        r_code = mafile_data.get('revocation_code', "missing")
-        steam_id = mafile_data.get('Session', {}).get('SteamID', "missing")
+        return None, None
+    
+    def stage(self, key, account_data):
+        """Staging account without marking it as changed"""
+        self.staged[key] = account_data
+        self.deletes.discard(key)
+        for identity in identity_values(account_data).items():
+            self._index[identity] = key
+    
+    def put(self, account_data, replaces=()):
+        """Staging account under its key, accounts under replaced keys are deleted.
         
-        # Create link if SteamID exists
-        link = f"https://steamcommunity.com/profiles/{steam_id}" if steam_id != "missing" else "missing"
+        Returns staged account data.
+        """
+        key = record_key(account_data)
         
-        # Create dictionary with account data from maFile
-        account_data = {
-            'login': account_name,
-            'password': "missing",
-            'mail': "missing",
-            'mail_password': "missing",
-            'r_code': r_code,
-            'steam_id': steam_id,
-            'link': link,
-            'mafile': mafile_data
-        }
+        # Key may be taken by another record of the same account, merge into it
+        if key not in replaces:
+            other = self.get(key)
+            if other is not None:
+                account_data = merge_records(other, account_data)
         
-        # Save maFile in single-line format for compatibility
-        if steam_id != "missing":
-            # Create file named by SteamID
-            with open(f"{steam_id}.maFile", 'w') as f:
-                json.dump(mafile_data, f, separators=(',', ':'))
-        elif account_name != "missing":
-            # Create file named by account_name
-            with open(f"{account_name}.maFile", 'w') as f:
-                json.dump(mafile_data, f, separators=(',', ':'))
+        for old_key in replaces:
+            if old_key is not None and old_key != key:
+                self.staged.pop(old_key, None)
+                self.changed.pop(old_key, None)
+                self.deletes.add(old_key)
         
+        self.stage(key, account_data)
+        self.changed[key] = None
         return account_data
+    
+    def add(self, account_data):
+        """Matching account with staged and stored ones and staging the result.
         
+        Returns:
+            tuple: (outcome, staged account data)
+        """
+        if not account_data or record_key(account_data) is None:
+            return IMPORT_REJECTED, None
+        
+        match_key, matching_account = self.find(account_data)
+        if matching_account is None:
+            return IMPORT_NEW, self.put(account_data)
+        
+        merged_data = merge_records(matching_account, account_data)
+        return IMPORT_MERGED, self.put(merged_data, replaces=(match_key,))
+    
+    def commit(self):
+        """Writing changed accounts and deletions with a single write"""
+        if not self.changed and not self.deletes:
+            return
+        items = [(key, self.staged[key]) for key in self.changed]
+        account_store.upsert_many(items, self.deletes)
+
+def process_data_line(line: str) -> dict:
+    """Processing one line of data, delimiter and format are detected by parse_account_line()"""
+    return parse_account_line(line)
+
+def process_mafile(content: str) -> dict:
+    """Processing maFile"""
+    try:
+        # Try to load JSON, regardless of formatting
+        mafile_data = json.loads(content)
     except json.JSONDecodeError:
         return None
+    
+    return mafile_to_account(mafile_data)
+
+def mafile_to_account(mafile_data) -> dict:
+    """Building account data from parsed maFile, returns None if it is not a maFile object"""
+    if not isinstance(mafile_data, dict):
+        return None
+    
+    # Get values
+    account_name = mafile_data.get('account_name', "missing")
+    r_code = mafile_data.get('revocation_code', "missing")
+    steam_id = (mafile_data.get('Session') or {}).get('SteamID', "missing")
+    # SteamID is a number in maFiles, keys and links use its string form
+    if steam_id != "missing":
+        steam_id = str(steam_id)
+    
+    # Create link if SteamID exists
+    link = f"https://steamcommunity.com/profiles/{steam_id}" if steam_id != "missing" else "missing"
+    
+    # Create dictionary with account data from maFile
+    return {
+        'login': account_name,
+        'password': "missing",
+        'mail': "missing",
+        'mail_password': "missing",
+        'r_code': r_code,
+        'steam_id': steam_id,
+        'link': link,
+        'mafile': mafile_data
+    }
+
+def process_mafile_bytes(data: bytes) -> dict:
+    """Decoding and processing maFile from archive (runs in worker processes)"""
+    try:
+        return process_mafile(decode_text(data))
+    except UnicodeDecodeError:
+        return None
 
 def save_processed_account(account_data):
     """Saves processed account with check for matches"""
-    # Check if there is a matching account in storage
-    matching_account = find_matching_account(account_data)
-    if matching_account:
-        # If exists, merge data
-        merged_data = merge_account_data(matching_account, account_data)
+    batch = AccountBatch()
+    outcome, saved_data = batch.add(account_data)
+    batch.commit()
+    queue_mafile_copy(account_data)
+    
+    if outcome == IMPORT_MERGED:
         logging.info(f"Account data {account_data.get('login')} merged with existing")
-        return merged_data
+    return saved_data
+
+def import_accounts(records, keys=None):
+    """Importing batch of accounts with a single write to storage.
+    
+    Records are matched and merged by the same rules as save_processed_account,
+    including records matching each other within the batch.
+    None entries (lines that failed to parse) are counted as rejected.
+    If keys list is given, storage key of every record (None if rejected) is appended to it.
+    
+    Returns:
+        list: outcome for each record (IMPORT_NEW, IMPORT_MERGED or IMPORT_REJECTED)
+    """
+    batch = AccountBatch()
+    outcomes = []
+    mafile_records = []
+    for account_data in records:
+        outcome, saved_data = batch.add(account_data)
+        outcomes.append(outcome)
+        if keys is not None:
+            keys.append(record_key(saved_data) if saved_data else None)
+        if account_data and account_data.get('mafile'):
+            mafile_records.append(account_data)
+    
+    # Commit whole batch with one write
+    batch.commit()
+    
+    # .maFile copies are written by background writer
+    for account_data in mafile_records:
+        queue_mafile_copy(account_data)
+    if batch.changed:
+        logging.info(f"Imported batch of {len(batch.changed)} accounts")
+    
+    return outcomes
+
+class ImportStats:
+    """Counters of a streaming import"""
+    
+    def __init__(self):
+        self.accounts = 0
+        self.mafiles = 0
+        self.outcomes = {IMPORT_NEW: 0, IMPORT_MERGED: 0, IMPORT_REJECTED: 0}
+        self.errors = []
+        self.error_count = 0
+        self.skipped = 0
+        self.already_imported = False
+        self.cancelled = False
+    
+    @property
+    def processed(self):
+        """Number of records matched and written so far"""
+        return sum(self.outcomes.values())
+    
+    def add_error(self, message):
+        """Counting error, only the first MAX_REPORTED_ERRORS messages are kept"""
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+def parse_mafiles(pending, stats, parallel=False):
+    """Parsing buffered (name, maFile bytes) items in order, in the shared process pool if parallel"""
+    contents = [content for name, content in pending]
+    if parallel:
+        records = process_map(process_mafile_bytes, contents)
     else:
-        # If not, save new account
-        store_account_data(account_data)
-        return account_data
+        records = map(process_mafile_bytes, contents)
+    
+    for (name, content), account_data in zip(pending, records):
+        if account_data:
+            stats.mafiles += 1
+            yield name, account_data
+        else:
+            stats.add_error(f"File {name} is not valid JSON")
+
+def parse_lines(lines, stats, delimiter=None):
+    """Parsing buffered (name, line) items with one parse_accounts_text() call, delimiter is detected when None"""
+    records, rejected = parse_accounts_text('\n'.join(line for name, line in lines), delimiter)
+    for line_number in rejected:
+        stats.add_error(f"{lines[line_number - 1][0]}: invalid account data format")
+    for line_number, account_data in records:
+        stats.accounts += 1
+        yield lines[line_number - 1][0], account_data
+
+def parse_import_items(items, stats):
+    """Parsing (kind, name, content) items into (name, account data) records.
+    
+    maFiles are buffered and parsed together, once MAFILE_PARALLEL_THRESHOLD of them
+    are collected the rest of the archive is parsed in the shared process pool
+    (unless there is only one CPU core to parse on).
+    Records keep the order of items.
+    Lines and maFiles that fail to parse are reported to stats and skipped.
+    """
+    pending = []
+    lines = []
+    # Delimiter of buffered lines: CSV rows have a known one, text lines have it detected
+    delimiter = None
+    parallel = False
+    for kind, name, content in items:
+        # Consecutive lines are parsed together as one buffer
+        if kind == ZIP_LINE or kind == ZIP_CSV_ROW:
+            if pending:
+                yield from parse_mafiles(pending, stats, parallel)
+                pending = []
+            line_delimiter = CSV_ROW_DELIMITER if kind == ZIP_CSV_ROW else None
+            if lines and line_delimiter != delimiter:
+                yield from parse_lines(lines, stats, delimiter)
+                lines = []
+            delimiter = line_delimiter
+            lines.append((name, content))
+            if len(lines) >= IMPORT_BATCH_SIZE:
+                yield from parse_lines(lines, stats, delimiter)
+                lines = []
+            continue
+        if lines:
+            yield from parse_lines(lines, stats, delimiter)
+            lines = []
+        
+        if kind == ZIP_MAFILE:
+            pending.append((name, content))
+            if len(pending) >= MAFILE_PARALLEL_THRESHOLD:
+                parallel = True
+                yield from parse_mafiles(pending, stats, parallel)
+                pending = []
+            continue
+        
+        # Parse buffered maFiles first to keep order of records
+        if pending:
+            yield from parse_mafiles(pending, stats, parallel)
+            pending = []
+        
+        if kind == ZIP_ERROR:
+            stats.add_error(content)
+    
+    if lines:
+        yield from parse_lines(lines, stats, delimiter)
+    if pending:
+        yield from parse_mafiles(pending, stats, parallel)
+
+def record_fingerprint(kind, content):
+    """Returns fingerprint of raw import item (accounts.txt line or maFile bytes)"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.blake2b(kind.encode('ascii') + b"\0" + content, digest_size=16).hexdigest()
+
+def load_json_meta(name, default):
+    """Returns storage metadata value saved with save_json_meta()"""
+    value = account_store.get_meta(name)
+    return json.loads(value) if value else default
+
+def save_json_meta(name, value):
+    """Saving metadata value as JSON string, so every backend stores it the same way"""
+    account_store.set_meta(name, json.dumps(value, separators=(',', ':')))
+
+def skip_unchanged(items, known, fingerprints, stats):
+    """Skipping items imported before whose account is still stored.
+    
+    known maps fingerprints of imported items to storage keys of their accounts,
+    fingerprints of passed items are put to fingerprints by item name.
+    """
+    for kind, name, content in items:
+        if kind != ZIP_ERROR:
+            fingerprint = record_fingerprint(kind, content)
+            key = known.get(fingerprint)
+            if key is not None and key in account_store:
+                stats.skipped += 1
+                continue
+            fingerprints[name] = fingerprint
+        yield kind, name, content
+
+def import_stream(items, batch_size=IMPORT_BATCH_SIZE, lock=None, stats=None, cancel=None):
+    """Importing stream of (kind, name, content) items in batches.
+    
+    Only one batch of parsed records is held in memory at a time,
+    each batch is matched and written with a single write while holding lock.
+    Items whose fingerprint matches an already imported record are skipped
+    before parsing and matching.
+    Counters are updated in stats (if given) as batches are written, so they can be
+    watched while import runs. When cancel event is set, import stops after the current batch.
+    
+    Returns:
+        ImportStats: counters of parsed records, outcomes and errors
+    """
+    if stats is None:
+        stats = ImportStats()
+    known = account_store.get_fingerprints()
+    fingerprints = {}
+    # Fingerprints of this import, only they are written, so imports finishing together keep each other's
+    imported = {}
+    records = parse_import_items(skip_unchanged(items, known, fingerprints, stats), stats)
+    while True:
+        if cancel is not None and cancel.is_set():
+            stats.cancelled = True
+            records.close()
+            break
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        keys = []
+        # maFile bodies are written and synced before taking the lock, so other writers do not wait for disk
+        account_store.store_mafiles([account_data['mafile'] for name, account_data in batch if account_data and account_data.get('mafile')])
+        with lock or nullcontext():
+            outcomes = import_accounts([account_data for name, account_data in batch], keys)
+        for outcome in outcomes:
+            stats.outcomes[outcome] += 1
+        for (name, account_data), key in zip(batch, keys):
+            fingerprint = fingerprints.pop(name)
+            if key is not None:
+                known[fingerprint] = key
+                # Re-inserting moves fingerprint to the end, the oldest ones are dropped first
+                imported.pop(fingerprint, None)
+                imported[fingerprint] = key
+    
+    # Written under the same lock as accounts and other metadata, only the most recent are kept
+    with lock or nullcontext():
+        account_store.add_fingerprints(list(imported.items()), MAX_RECORD_FINGERPRINTS)
+    return stats
+
+def is_upload_imported(file_unique_id, content_hash):
+    """Checks whether upload with the same Telegram file_unique_id or content was imported"""
+    return any(
+        file_unique_id == uploaded_id or content_hash == uploaded_hash
+        for uploaded_id, uploaded_hash in load_json_meta('imported_uploads', [])
+    )
+
+def remember_upload(file_unique_id, content_hash):
+    """Remembering imported upload, only the last MAX_REMEMBERED_UPLOADS are kept"""
+    uploads = load_json_meta('imported_uploads', [])
+    uploads.append([file_unique_id, content_hash])
+    save_json_meta('imported_uploads', uploads[-MAX_REMEMBERED_UPLOADS:])
+
+def forget_uploads():
+    """Forgetting imported uploads, so they are imported again after accounts are deleted"""
+    save_json_meta('imported_uploads', [])
+
+def deduplicate_accounts():
+    """One-time pass merging accounts stored twice under different keys.
+    
+    Also re-keys accounts stored under login whose SteamID is known.
+    Returns number of merged duplicates.
+    """
+    if account_store.get_meta('deduplicated'):
+        return 0
+    
+    batch = AccountBatch(use_store=False)
+    merged_count = 0
+    for key, account_data in list(account_store.items()):
+        match_key, matching_account = batch.find(account_data)
+        if matching_account is not None:
+            # Later record wins on conflicting fields, as with sequential imports
+            batch.put(merge_records(matching_account, account_data), replaces=(match_key, key))
+            merged_count += 1
+        elif key != record_key(account_data):
+            batch.put(account_data, replaces=(key,))
+        else:
+            batch.stage(key, account_data)
+    
+    batch.commit()
+    account_store.set_meta('deduplicated', True)
+    logging.info(f"Deduplication merged {merged_count} duplicate accounts")
+    return merged_count
 
 def delete_account(account_id):
     """Deleting account from storage"""
-    accounts = load_accounts()
-    if account_id in accounts:
-        del accounts[account_id]
-        save_accounts(accounts)
-        return True
-    return False
+    if not account_store.delete(account_id):
+        return False
+    forget_uploads()
+    return True
 
 def clear_all_accounts():
     """Clearing all accounts"""
-    save_accounts({})
+    account_store.clear()
+    forget_uploads()
     return True 
\ No newline at end of file
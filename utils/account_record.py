@@ -0,0 +1,82 @@
+import sys
+
+class _Missing:
+    """Sentinel for account fields with no value ("missing" in JSON)"""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "MISSING"
+
+    def __bool__(self):
+        return False
+
+MISSING = _Missing()
+
+# Fields whose values are often repeated between accounts and are interned
+INTERNED_FIELDS = ('password', 'mail_password', 'r_code')
+
+class Account:
+    """Compact in-memory account record.
+
+    Uses __slots__ instead of a per-record dict, keeps the MISSING sentinel
+    instead of repeated "missing" strings and interns commonly repeated values.
+    Conversion to and from the JSON shape of accounts.json is explicit:
+    from_dict() and to_dict().
+    """
+
+    __slots__ = (
+        'login',
+        'password',
+        'mail',
+        'mail_password',
+        'r_code',
+        'steam_id',
+        'link',
+        'mafile_account',
+        'mafile_ref',
+        'modified',
+        'extra'
+    )
+
+    # Fields converted to and from the JSON shape, in the order they are written
+    FIELDS = __slots__[:-1]
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, None)
+
+    @classmethod
+    def from_dict(cls, account_data):
+        """Creates record from account dict"""
+        account = cls()
+        extra = None
+        for field, value in account_data.items():
+            if field not in cls.FIELDS:
+                # Unknown fields are kept as is
+                if extra is None:
+                    extra = {}
+                extra[field] = value
+                continue
+
+            if value == "missing":
+                value = MISSING
+            elif field in INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            setattr(account, field, value)
+
+        account.extra = extra
+        return account
+
+    def to_dict(self):
+        """Converts record to account dict in the accounts.json format"""
+        account_data = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is None:
+                # Field was not present in the original dict
+                continue
+            account_data[field] = "missing" if value is MISSING else value
+        if self.extra:
+            account_data.update(self.extra)
+        return account_data
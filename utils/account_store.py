@@ -0,0 +1,339 @@
+import json
+import time
+import logging
+import threading
+import config
+from utils.blob_store import FileBlobStore
+from utils.group_commit import GroupCommitWriter
+from utils.snapshot_backend import SnapshotBackend
+from utils.account_index import AccountIndex, parse_filter
+from utils.storage_backends import (
+    JsonBackend,
+    JournalBackend,
+    SqliteBackend,
+    migrate_json_accounts,
+    identity_values,
+    externalize_mafile,
+    STAMP_FIELD
+)
+
+# Path to the accounts data file
+ACCOUNTS_FILE = 'accounts.json'
+
+# Storage backend: 'json' keeps accounts in memory and in accounts.json,
+# 'journal' also keeps them in memory but appends changes to a journal file,
+# 'snapshot' appends changes to a journal too, but reads accounts from a memory-mapped
+# snapshot one by one instead of holding all of them in memory,
+# 'sqlite' keeps them in an indexed SQLite database
+STORAGE_BACKEND = getattr(config, 'STORAGE_BACKEND', 'json')
+
+# Journal size in bytes after which the accounts.json snapshot is rewritten
+JOURNAL_COMPACT_SIZE = getattr(config, 'JOURNAL_COMPACT_SIZE', 16 * 1024 * 1024)
+
+# Directory of maFile bodies for json, journal and snapshot backends
+# (sqlite backend keeps them in the database)
+MAFILE_BLOB_DIR = getattr(config, 'MAFILE_BLOB_DIR', 'mafile_blobs')
+
+# Path to the JSON-lines snapshot of snapshot backend (index is kept next to it)
+SNAPSHOT_FILE = getattr(config, 'SNAPSHOT_FILE', 'accounts.jsonl')
+
+# Number of decoded snapshot records kept in memory
+SNAPSHOT_CACHE_SIZE = getattr(config, 'SNAPSHOT_CACHE_SIZE', 1024)
+
+# Path to the SQLite database file
+SQLITE_FILE = getattr(config, 'SQLITE_FILE', 'accounts.db')
+
+# Changes made within this window (or until this many changes) are written with one flush
+WRITE_DELAY_MS = getattr(config, 'WRITE_DELAY_MS', 200)
+WRITE_MAX_OPS = getattr(config, 'WRITE_MAX_OPS', 500)
+
+def record_key(account_data):
+    """Returns storage key of account: SteamID if present, otherwise login"""
+    if account_data.get('steam_id'):
+        return account_data['steam_id']
+    if account_data.get('login'):
+        return account_data['login']
+    return None
+
+def create_backend(name=STORAGE_BACKEND):
+    """Creates storage backend by name"""
+    if name == 'sqlite':
+        backend = SqliteBackend(SQLITE_FILE)
+        backend.load()
+        migrate_json_accounts(ACCOUNTS_FILE, backend)
+        return backend
+
+    if name == 'snapshot':
+        backend = SnapshotBackend(SNAPSHOT_FILE, FileBlobStore(MAFILE_BLOB_DIR), JOURNAL_COMPACT_SIZE, SNAPSHOT_CACHE_SIZE)
+        backend.load()
+        # Write migrated accounts to the snapshot instead of keeping them in the journal
+        if migrate_json_accounts(ACCOUNTS_FILE, backend):
+            backend.compact()
+        return backend
+
+    if name == 'journal':
+        backend = JournalBackend(ACCOUNTS_FILE, FileBlobStore(MAFILE_BLOB_DIR), JOURNAL_COMPACT_SIZE)
+        backend.load()
+        return backend
+
+    if name != 'json':
+        logging.error(f"Unknown storage backend {name}, using json")
+    backend = JsonBackend(ACCOUNTS_FILE, FileBlobStore(MAFILE_BLOB_DIR))
+    backend.load()
+    return backend
+
+class AccountStore:
+    """Long-lived account storage.
+
+    The storage backend is opened once and all reads and writes go through it.
+    This is the only place that writes accounts data to disk.
+    Returned records may be shared with the store and must not be modified in place,
+    use upsert() to change them.
+    maFile bodies are not part of the records: they are kept in the backend's
+    blob store and loaded on demand with get_mafile_content().
+    generation goes up on every change of accounts, listeners added with
+    add_change_listener() are called with the new generation (from the writing thread).
+    Every upserted record gets a modification stamp (microseconds since the epoch,
+    always above stamps issued before), which is kept by the backend across restarts.
+    Bitset index used by select() is built on its first call and kept up to date
+    by every change after that.
+    """
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._writer = None
+        self.generation = 0
+        self.stamp = 0
+        self._change_listeners = []
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def load(self):
+        """Opening configured storage backend"""
+        if self._backend is None:
+            self._backend = create_backend()
+        self._externalize_existing()
+        self._move_fingerprints()
+        # Stamps stay above ones issued before the restart even if the clock went back
+        self.stamp = max(self.stamp, self._backend.max_stamp(), self._saved_export_stamp())
+        logging.info(f"Loaded {self._backend.count()} accounts from {self._backend.path}")
+
+    def _saved_export_stamp(self):
+        """Returns the largest stamp of remembered ASF exports (saved by utils.asf_exports)"""
+        value = self._backend.get_meta('asf_exports')
+        exports = json.loads(value) if value else {}
+        return max((export['stamp'] for export in exports.values()), default=0)
+
+    def _externalize_existing(self):
+        """Moving maFiles embedded in records by older versions into blob store"""
+        if self._backend.get_meta('mafiles_externalized'):
+            return
+
+        items = [
+            (key, externalize_mafile(account_data, self._backend.blobs))
+            for key, account_data in self._backend.items()
+            if 'mafile' in account_data
+        ]
+        if items:
+            self._backend.blobs.sync()
+            self._backend.upsert_many(items)
+            logging.info(f"Moved {len(items)} maFiles to blob store")
+        self._backend.set_meta('mafiles_externalized', True)
+
+    def _move_fingerprints(self):
+        """Moving import fingerprints kept in metadata by older versions to their own file or table"""
+        value = self._backend.get_meta('import_fingerprints')
+        if not value:
+            return
+        self._backend.add_fingerprints(list(json.loads(value).items()))
+        self._backend.set_meta('import_fingerprints', None)
+        logging.info("Moved import fingerprints out of storage metadata")
+
+    def collect_garbage(self):
+        """Deleting maFile bodies no longer referenced by any account"""
+        deleted = self.backend.collect_garbage()
+        if deleted:
+            logging.info(f"Deleted {deleted} unreferenced maFile blobs")
+        return deleted
+
+    def close(self):
+        """Closing storage backend"""
+        if self._backend is not None:
+            self._backend.close()
+
+    def start_writer(self):
+        """Starting group-commit writer on the running event loop.
+
+        From now on changes are kept by the backend and flushed to disk together
+        by a single writer task.
+        """
+        self._writer = GroupCommitWriter(self.backend.flush, WRITE_DELAY_MS, WRITE_MAX_OPS)
+        self._writer.start()
+        self.backend.deferred = True
+
+    async def stop_writer(self):
+        """Stopping group-commit writer and flushing remaining changes"""
+        if self._writer is None:
+            return
+        await self._writer.stop()
+        self.backend.deferred = False
+        self._writer = None
+
+    async def wait_durable(self):
+        """Waiting until all changes made so far are written to disk"""
+        if self._writer is not None:
+            await self._writer.wait_durable()
+
+    def add_change_listener(self, listener):
+        """Registering listener(generation) called after every change of accounts"""
+        self._change_listeners.append(listener)
+
+    def next_stamp(self):
+        """Returns modification stamp above all stamps issued before.
+
+        Records upserted after the call get larger stamps, so taking a stamp
+        marks the point later changes are counted from.
+        """
+        self.stamp = max(time.time_ns() // 1000, self.stamp + 1)
+        return self.stamp
+
+    def _changed(self):
+        self.generation += 1
+        for listener in self._change_listeners:
+            listener(self.generation)
+        if self._writer is not None:
+            self._writer.notify()
+
+    @property
+    def backend(self):
+        """Storage backend, opened on first access"""
+        if self._backend is None:
+            self.load()
+        return self._backend
+
+    # Reads
+
+    def get(self, key):
+        """Returns account by key or None"""
+        return self.backend.get(key)
+
+    def find_key(self, account_data):
+        """Returns key of stored account with any of the identities of account_data.
+
+        SteamID is checked first, then login, then maFile account name.
+        """
+        for field, value in identity_values(account_data).items():
+            key = self.backend.find_key(field, value)
+            if key is not None:
+                return key
+        return None
+
+    def __contains__(self, key):
+        return self.backend.contains(key)
+
+    def __len__(self):
+        return self.backend.count()
+
+    def keys(self):
+        """Returns iterator over account keys"""
+        return self.backend.keys()
+
+    def items(self):
+        """Returns iterator over (key, account) pairs"""
+        return self.backend.items()
+
+    def page(self, page, items_per_page):
+        """Returns list of (key, account) pairs for the given page"""
+        return self.backend.page(page * items_per_page, items_per_page)
+
+    def select(self, expression):
+        """Returns keys of accounts matching filter expression (see parse_filter()).
+
+        Raises FilterError if the expression is not valid.
+        """
+        node = parse_filter(expression)
+        return self._get_index().select(node)
+
+    def _get_index(self):
+        with self._index_lock:
+            if self._index is None:
+                index = AccountIndex()
+                # Changes written while the accounts are read wait for the index,
+                # changes written before are read with the accounts
+                with index.lock:
+                    self._index = index
+                    index.update(self.backend.items())
+                logging.info(f"Indexed {len(index)} accounts for filters")
+            return self._index
+
+    def get_mafile_content(self, account_data):
+        """Returns maFile of account in single-line JSON format, empty string if there is none"""
+        if account_data.get('mafile'):
+            return json.dumps(account_data['mafile'], separators=(',', ':'))
+        if not account_data.get('mafile_ref'):
+            return ""
+        return self.backend.blobs.get_body(account_data['mafile_ref'])
+
+    # Writes
+
+    def upsert(self, key, account_data):
+        """Inserts or replaces account under the given key"""
+        self.upsert_many([(key, account_data)])
+
+    def store_mafiles(self, mafiles):
+        """Writing maFile bodies of accounts about to be upserted, may run without holding the write lock"""
+        self.backend.blobs.put_many(mafiles)
+
+    def upsert_many(self, items, deletes=()):
+        """Inserts or replaces several accounts with a single write.
+
+        items is an iterable of (key, account) pairs,
+        accounts with keys from deletes are removed before that (used to re-key accounts).
+        """
+        blobs = self.backend.blobs
+        stamp = self.next_stamp()
+        items = [
+            (key, {**externalize_mafile(account_data, blobs), STAMP_FIELD: stamp})
+            for key, account_data in items
+        ]
+        # maFile bodies are durable before any record references them
+        blobs.sync()
+        self.backend.upsert_many(items, deletes)
+        if self._index is not None:
+            self._index.update(items, deletes)
+        self._changed()
+
+    def delete(self, key):
+        """Deletes account by key, returns True if it existed"""
+        if not self.backend.delete(key):
+            return False
+        if self._index is not None:
+            self._index.remove(key)
+        self._changed()
+        return True
+
+    def clear(self):
+        """Deletes all accounts"""
+        self.backend.clear()
+        if self._index is not None:
+            self._index.clear()
+        self._changed()
+
+    def get_meta(self, name):
+        """Returns storage metadata value"""
+        return self.backend.get_meta(name)
+
+    def set_meta(self, name, value):
+        """Sets storage metadata value"""
+        self.backend.set_meta(name, value)
+
+    def get_fingerprints(self):
+        """Returns {fingerprint: key} of imported records, the oldest first"""
+        return self.backend.get_fingerprints()
+
+    def add_fingerprints(self, items, limit=None):
+        """Remembering (fingerprint, key) pairs of imported records, only the last limit are kept"""
+        self.backend.add_fingerprints(items, limit)
+
+# Shared store instance used by handlers and utils
+account_store = AccountStore()
@@ -0,0 +1,73 @@
+import json
+import hashlib
+import config
+from utils.account_store import account_store
+from utils.account_manager import load_json_meta, save_json_meta
+from utils.storage_backends import STAMP_FIELD
+
+# Number of templates whose last ASF export is remembered for delta exports
+ASF_EXPORT_HISTORY = getattr(config, 'ASF_EXPORT_HISTORY', 8)
+
+def template_hash(template_json):
+    """Returns hash of ASF template that does not depend on its formatting"""
+    canonical = json.dumps(json.loads(template_json), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def asf_export_key(template_json, account_filter=None):
+    """Returns key of exports with the template and filter (normalized expression or None)"""
+    key = template_hash(template_json)
+    return f"{key}:{account_filter}" if account_filter else key
+
+def last_asf_export(key):
+    """Returns {'stamp', 'names'} of the last ASF export with the key or None"""
+    return load_json_meta('asf_exports', {}).get(key)
+
+class AsfExport:
+    """
+    ASF export with one template, full or delta, of all accounts or ones matching a filter.
+
+    The last export of every template and filter is remembered in storage metadata:
+    the modification stamp taken when it was started and names of exported bots.
+    A delta export writes only accounts upserted after that stamp and lists
+    bots exported last time that are gone (deleted, renamed, without password now
+    or not matching the filter anymore).
+    """
+
+    def __init__(self, template_json, delta=False, account_filter=None):
+        self.key = asf_export_key(template_json, account_filter)
+        self.account_filter = account_filter
+        previous = last_asf_export(self.key) if delta else None
+        # Stamp of the previous export, None exports all accounts
+        self.since = previous['stamp'] if previous else None
+        self._previous_names = set(previous['names']) if previous else set()
+        self.stamp = None
+        # Keys of accounts matching the filter, None exports all accounts
+        self.keys = None
+        self.names = set()
+        self.finished = False
+
+    def begin(self):
+        """Taking stamp of this export and selecting its accounts, called while no change is being written"""
+        self.stamp = account_store.next_stamp()
+        if self.account_filter:
+            self.keys = account_store.select(self.account_filter)
+
+    def is_changed(self, account_data):
+        """Checks if account was upserted after the previous export"""
+        return self.since is None or (account_data.get(STAMP_FIELD) or 0) > self.since
+
+    def removed(self):
+        """Returns sorted names of bots exported last time and not now"""
+        return sorted(self._previous_names - self.names)
+
+    def save(self):
+        """Remembering this export as the last one of its template, only once all of it was built"""
+        if not self.finished:
+            return
+        exports = load_json_meta('asf_exports', {})
+        # Recently used templates are kept at the end
+        exports.pop(self.key, None)
+        exports[self.key] = {'stamp': self.stamp, 'names': sorted(self.names)}
+        while len(exports) > ASF_EXPORT_HISTORY:
+            del exports[next(iter(exports))]
+        save_json_meta('asf_exports', exports)
\ No newline at end of file
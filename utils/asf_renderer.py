@@ -0,0 +1,85 @@
+import copy
+import json
+from json.encoder import encode_basestring_ascii
+import config
+
+# Optional ASF config fields filled from account data: ASF key -> account field,
+# a field is set only for accounts that have a non-empty value of it
+ASF_OPTIONAL_FIELDS = getattr(config, 'ASF_OPTIONAL_FIELDS', {'SteamParentalCode': 'parental_code'})
+
+def account_values(account_data):
+    """Returns ASF config fields of account: SteamLogin, SteamPassword and optional fields it has"""
+    values = {
+        'SteamLogin': account_data['login'],
+        'SteamPassword': account_data['password']
+    }
+    for key, field in ASF_OPTIONAL_FIELDS.items():
+        if account_data.get(field):
+            values[key] = account_data[field]
+    return values
+
+def encode_value(value):
+    """Returns JSON of config value, the same json.dumps() would write"""
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    return json.dumps(value)
+
+class AsfConfigRenderer:
+    """
+    Renders ASF bot configs of accounts from one template.
+
+    The template is serialized once per set of filled fields with placeholders
+    in their places, rendering a config only encodes the account's values
+    and puts them into the serialized template. Output is the same as
+    json.dumps(config, indent=2) of the template with the fields assigned:
+    fields present in the template keep their place, other ones are added at the end.
+    """
+
+    def __init__(self, template):
+        if not isinstance(template, dict):
+            raise ValueError("ASF config template must be a JSON object")
+        self._template = template
+        # (filled keys) -> (%-format string of the serialized template, order of values in it)
+        self._layouts = {}
+
+    @classmethod
+    def from_json(cls, template_json):
+        """Creates renderer from template text, raises ValueError if it is not a JSON object"""
+        return cls(json.loads(template_json))
+
+    def render(self, values):
+        """Returns JSON text of config with fields from values (ASF key -> value) filled"""
+        keys = tuple(values)
+        compiled = self._layouts.get(keys)
+        if compiled is None:
+            compiled = self._layouts[keys] = self._compile(keys)
+        layout, order = compiled
+        encoded = [encode_value(value) for value in values.values()]
+        return layout % tuple(encoded[index] for index in order)
+
+    def config(self, values):
+        """Returns config object with fields from values filled, it shares nothing with the template"""
+        account_config = copy.deepcopy(self._template)
+        account_config.update(values)
+        return account_config
+
+    def _compile(self, keys):
+        # Placeholders are JSON strings, a nonce keeps them apart from template values
+        nonce = 0
+        while True:
+            placeholders = {key: f"\x00{nonce}:{key}\x00" for key in keys}
+            text = json.dumps({**self._template, **placeholders}, indent=2)
+            encoded = [json.dumps(placeholder) for placeholder in placeholders.values()]
+            if all(text.count(placeholder) == 1 for placeholder in encoded):
+                break
+            nonce += 1
+
+        # Fields of the template keep their places, so placeholders are not in the order of keys
+        positions = sorted((text.index(placeholder), index) for index, placeholder in enumerate(encoded))
+        pieces = []
+        start = 0
+        for position, index in positions:
+            pieces.append(text[start:position].replace('%', '%%'))
+            start = position + len(encoded[index])
+        pieces.append(text[start:].replace('%', '%%'))
+        return '%s'.join(pieces), tuple(index for position, index in positions)
\ No newline at end of file
@@ -0,0 +1,195 @@
+import asyncio
+import functools
+import threading
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+import config
+from utils.account_store import account_store
+from utils.account_manager import (
+    save_processed_account,
+    import_stream,
+    delete_account,
+    clear_all_accounts,
+    is_upload_imported,
+    remember_upload,
+    ImportStats
+)
+from utils.uploads import hash_upload
+from utils.file_handlers import (
+    create_account_zip,
+    iter_all_accounts_zip_parts,
+    iter_asf_configs_zip_parts
+)
+from utils.zip_processor import iter_zip_archive, iter_text_file, iter_text_lines
+from utils.asf_exports import AsfExport, asf_export_key, last_asf_export
+
+# Maximum number of threads running blocking storage and archive work
+IO_WORKERS = getattr(config, 'IO_WORKERS', 4)
+
+_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="storage-io")
+
+# Changes are made one at a time, so every batch sees the results of the previous ones
+_write_lock = threading.Lock()
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs blocking function in the I/O thread pool and returns its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def shutdown_io():
+    """Waiting for running blocking work and stopping the I/O thread pool"""
+    _executor.shutdown(wait=True)
+
+async def prefetch_parts(parts):
+    """Yields archive parts of blocking generator, building the next part in the I/O pool
+    while the current one is used (uploaded). Parts built but not consumed are closed.
+    """
+    pending = asyncio.ensure_future(run_blocking(next, parts, None))
+    try:
+        while True:
+            part = await pending
+            pending = None
+            if part is None:
+                return
+            pending = asyncio.ensure_future(run_blocking(next, parts, None))
+            yield part
+    finally:
+        if pending is not None:
+            part, = await asyncio.gather(pending, return_exceptions=True)
+            if part is not None and not isinstance(part, BaseException):
+                part.close()
+        await run_blocking(parts.close)
+
+def _locked(func, *args):
+    with _write_lock:
+        return func(*args)
+
+class AsyncAccountStore:
+    """Async facade over the account store and archive builders.
+
+    Handlers await its methods instead of calling blocking functions directly:
+    the work runs in a bounded thread pool, so a large import or export
+    does not stop the bot from answering other updates.
+    Changes are serialized and awaited until they are written to disk.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    async def _write(self, func, *args):
+        result = await run_blocking(_locked, func, *args)
+        await self._store.wait_durable()
+        return result
+
+    # Reads
+
+    async def count(self):
+        """Returns number of accounts"""
+        return await run_blocking(len, self._store)
+
+    async def get(self, key):
+        """Returns account by key or None"""
+        return await run_blocking(self._store.get, key)
+
+    # Writes
+
+    async def save_processed_account(self, account_data):
+        """Saves parsed account merging it with a matching one, returns saved data"""
+        return await self._write(save_processed_account, account_data)
+
+    async def delete_account(self, key):
+        """Deletes account by key, returns True if it existed"""
+        return await self._write(delete_account, key)
+
+    async def clear_all_accounts(self):
+        """Deletes all accounts, returns True on success"""
+        return await self._write(clear_all_accounts)
+
+    async def import_zip(self, zip_file, file_unique_id=None, stats=None, cancel=None):
+        """Imports ZIP archive (binary file object) with accounts.txt and maFiles, returns ImportStats"""
+        return await self.import_upload(zip_file, iter_zip_archive(zip_file), file_unique_id, stats, cancel)
+
+    async def import_text_file(self, upload, name, file_unique_id=None, stats=None, cancel=None):
+        """Imports uploaded .txt or .csv file with one account per line, returns ImportStats"""
+        return await self.import_upload(upload, iter_text_file(upload, name), file_unique_id, stats, cancel)
+
+    async def import_text(self, text):
+        """Imports multi-line message with one account per line, returns ImportStats"""
+        stats = await run_blocking(import_stream, iter_text_lines(text.splitlines(), "line"), lock=_write_lock)
+        await self._store.wait_durable()
+        return stats
+
+    async def import_upload(self, upload, items, file_unique_id=None, stats=None, cancel=None):
+        """Imports items read from uploaded file, returns ImportStats.
+
+        Uploads already imported (same Telegram file_unique_id or same content)
+        are not processed again, stats.already_imported is set for them.
+        Items are streamed in batches, the write lock is taken only
+        while a batch is matched and written.
+        stats and cancel are passed to import_stream() to watch and cancel the import.
+        """
+        content_hash = await run_blocking(hash_upload, upload)
+        if await run_blocking(is_upload_imported, file_unique_id, content_hash):
+            stats = stats or ImportStats()
+            stats.already_imported = True
+            return stats
+
+        stats = await run_blocking(
+            import_stream,
+            items,
+            lock=_write_lock,
+            stats=stats,
+            cancel=cancel
+        )
+        # Cancelled import did not process the whole archive
+        if not stats.cancelled:
+            await run_blocking(_locked, remember_upload, file_unique_id, content_hash)
+        await self._store.wait_durable()
+        return stats
+
+    # Archives are returned as rewound spooled files, the caller must close them
+
+    async def create_account_zip(self, account_data):
+        """Creates ZIP archive with data of one account"""
+        return await run_blocking(create_account_zip, account_data)
+
+    async def all_accounts_zip_parts(self, account_filter=None):
+        """Async iterator over parts of archive with all accounts or ones matching the filter,
+        the next part is built while one is sent.
+        """
+        keys = None
+        if account_filter:
+            # Index is built on the first filter, so no change may be written meanwhile
+            keys = await run_blocking(_locked, self._store.select, account_filter)
+        async with aclosing(prefetch_parts(iter_all_accounts_zip_parts(keys=keys))) as parts:
+            async for part in parts:
+                yield part
+
+    async def asf_configs_zip_parts(self, template_json, export=None):
+        """Async iterator over parts of archive with ASF configs, the next part is built while one is sent.
+
+        With export (AsfExport) only changed accounts are written, see iter_asf_configs_zip_parts().
+        """
+        if export is not None:
+            # Changes written after the stamp is taken are left for the next delta export
+            await run_blocking(_locked, export.begin)
+        async with aclosing(prefetch_parts(iter_asf_configs_zip_parts(template_json, export=export))) as parts:
+            async for part in parts:
+                yield part
+
+    # ASF export state
+
+    async def has_asf_export(self, template_json, account_filter=None):
+        """Checks if configs were exported with the template and filter before"""
+        return await run_blocking(last_asf_export, asf_export_key(template_json, account_filter)) is not None
+
+    async def asf_export(self, template_json, delta=False, account_filter=None):
+        """Returns AsfExport of the template and filter, delta one is compared with the previous export"""
+        return await run_blocking(AsfExport, template_json, delta, account_filter)
+
+    async def save_asf_export(self, export):
+        """Remembering completely sent export as the last one of its template"""
+        await self._write(export.save)
+
+# Shared async facade used by handlers
+async_store = AsyncAccountStore(account_store)
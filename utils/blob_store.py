@@ -0,0 +1,138 @@
+import json
+import os
+import hashlib
+import logging
+import threading
+
+def encode_blob(data):
+    """Returns (reference, compact JSON body) of maFile data.
+
+    Reference is SHA-256 of the body, so equal maFiles are stored once.
+    """
+    body = json.dumps(data, separators=(',', ':'))
+    return hashlib.sha256(body.encode('utf-8')).hexdigest(), body
+
+def sync_directory(directory):
+    """Syncing directory entries (names of renamed files) to disk where the OS allows it"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class FileBlobStore:
+    """Content-addressed store of maFile bodies in a directory tree.
+
+    put() does not sync the body, sync() makes all bodies written since
+    the last call durable at once and must run before records referencing them are written.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._unsynced = set()
+        self._lock = threading.Lock()
+        # Held while syncing, so a sync() returns only after bodies written before it are durable
+        self._sync_lock = threading.Lock()
+
+    def _path(self, ref):
+        # Shard by first two characters of the hash to keep directories small
+        return os.path.join(self.root, ref[:2], f"{ref}.json")
+
+    def put(self, data):
+        """Stores maFile data and returns its reference, the body is made durable by sync()"""
+        ref, body = encode_blob(data)
+        path = self._path(ref)
+        if os.path.exists(path):
+            return ref
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The same body may be written by another thread at the same time
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._unsynced.add(path)
+        return ref
+
+    def put_many(self, mafiles):
+        """Stores and syncs maFiles ahead of their records, so writing the records does not wait for disk"""
+        for mafile in mafiles:
+            self.put(mafile)
+        self.sync()
+
+    def sync(self):
+        """Syncing bodies written since the last call: files first, then directories with their names"""
+        with self._sync_lock:
+            with self._lock:
+                paths, self._unsynced = self._unsynced, set()
+            if not paths:
+                return
+            for path in paths:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            # New shard directories are entries of the root
+            for directory in {os.path.dirname(path) for path in paths} | {self.root}:
+                sync_directory(directory)
+
+    def get_body(self, ref):
+        """Returns compact JSON body of maFile by reference or empty string"""
+        try:
+            with open(self._path(ref), 'r') as f:
+                return f.read()
+        except OSError as e:
+            logging.error(f"Error reading maFile blob {ref}: {e}")
+            return ""
+
+    def retain(self, refs):
+        """Deletes blobs not in refs, returns number of deleted blobs"""
+        if not os.path.isdir(self.root):
+            return 0
+
+        deleted = 0
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            for name in os.listdir(shard_dir):
+                if name[:-len(".json")] not in refs:
+                    os.remove(os.path.join(shard_dir, name))
+                    deleted += 1
+        return deleted
+
+class SqliteBlobStore:
+    """Content-addressed store of maFile bodies in the blobs table of SQLite database"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def put(self, data):
+        """Stores maFile data and returns its reference"""
+        ref, body = encode_blob(data)
+        with self._backend._write() as conn:
+            conn.execute("INSERT OR IGNORE INTO blobs (ref, body) VALUES (?, ?)", (ref, body))
+        return ref
+
+    def put_many(self, mafiles):
+        """Nothing to do ahead of records, bodies are committed in the same transaction as them"""
+
+    def sync(self):
+        """Bodies are committed with the records referencing them"""
+
+    def get_body(self, ref):
+        """Returns compact JSON body of maFile by reference or empty string"""
+        with self._backend._lock:
+            row = self._backend._conn.execute("SELECT body FROM blobs WHERE ref = ?", (ref,)).fetchone()
+        return row[0] if row else ""
+
+    def retain(self):
+        """Deletes blobs not referenced by any account, returns number of deleted blobs"""
+        with self._backend._write() as conn:
+            cursor = conn.execute(
+                "DELETE FROM blobs WHERE ref NOT IN "
+                "(SELECT mafile_ref FROM accounts WHERE mafile_ref IS NOT NULL)"
+            )
+        return cursor.rowcount
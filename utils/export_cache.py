@@ -0,0 +1,120 @@
+import logging
+import threading
+from collections import OrderedDict
+import config
+from telegram import InputFile
+from telegram.error import BadRequest
+from utils.account_store import account_store
+
+# Number of sent archives whose Telegram file_ids are remembered
+EXPORT_CACHE_SIZE = getattr(config, 'EXPORT_CACHE_SIZE', 64)
+
+class ExportCache:
+    """Telegram file_ids of parts of sent archives by (kind, store generation, extra) key.
+
+    extra tells archives of one kind apart: account key or ASF template hash.
+    An archive is only valid for the generation it was built from, so all entries
+    are dropped when accounts change, and the least recently used ones
+    are evicted above max_size.
+    """
+
+    def __init__(self, max_size=EXPORT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # Store changes invalidate the cache from writing threads
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns file_ids of archive parts sent before or None"""
+        with self._lock:
+            file_ids = self._entries.get(key)
+            if file_ids is not None:
+                self._entries.move_to_end(key)
+            return file_ids
+
+    def put(self, key, file_ids):
+        """Remembering file_ids of sent archive parts, ignored if accounts changed since it was built"""
+        kind, generation, extra = key
+        with self._lock:
+            if generation != account_store.generation:
+                return
+            self._entries[key] = file_ids
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Forgetting archive whose file_ids can not be sent anymore"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate(self, generation=None):
+        """Dropping all archives, called when accounts change"""
+        with self._lock:
+            self._entries.clear()
+
+# Shared cache of sent archives, emptied on every change of accounts
+export_cache = ExportCache()
+account_store.add_change_listener(export_cache.invalidate)
+
+def part_filename(filename, part):
+    """Returns name of archive part: the first one keeps the name, next ones are name_N.zip"""
+    if part == 1:
+        return filename
+    stem, dot, extension = filename.rpartition('.')
+    return f"{stem}_{part}.{extension}"
+
+async def single_part(build):
+    """Async iterator over the archive built by build() coroutine function, empty if it returns None"""
+    export = await build()
+    if export:
+        yield export
+
+async def send_export(send, kind, parts, filename, extra=None):
+    """
+    Sends archive parts, reusing Telegram file_ids of the same archive sent before.
+
+    Args:
+        send: coroutine function sending document (file_id or InputFile) of the given
+            part number, returns sent Message
+        kind: kind of archive ('all', 'account' or 'asf')
+        parts: function returning async iterator of rewound spooled files of archive parts
+        filename: name of uploaded archive, parts after the first get _N suffix
+        extra: account key or template hash for archives of one kind
+
+    Returns:
+        bool: False if there was nothing to export
+    """
+    key = (kind, account_store.generation, extra)
+
+    # Same archive was sent before: resend it without building and uploading
+    file_ids = export_cache.get(key)
+    if file_ids is not None:
+        try:
+            for part, file_id in enumerate(file_ids, 1):
+                await send(file_id, part)
+            return True
+        except BadRequest as e:
+            logging.warning(f"Cached {kind} archive could not be resent, building it again: {e}")
+            export_cache.discard(key)
+
+    # InputFile reads a part into memory for its upload, so only one part is held at a time;
+    # part files are deleted when closed
+    file_ids = []
+    archive_parts = parts()
+    try:
+        async for export in archive_parts:
+            part = len(file_ids) + 1
+            try:
+                message = await send(InputFile(export, filename=part_filename(filename, part)), part)
+            finally:
+                export.close()
+            file_ids.append(message.document.file_id if message.document else None)
+    finally:
+        await archive_parts.aclose()
+
+    if not file_ids:
+        return False
+    if all(file_ids):
+        export_cache.put(key, file_ids)
+    return True
\ No newline at end of file
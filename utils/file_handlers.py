@@ -1,17 +1,41 @@
 import os
 import zipfile
-import io
-import json
 import tempfile
-from utils.account_manager import load_accounts
+from contextlib import contextmanager
+import config
+from utils.account_store import account_store
+from utils.zip_writer import ZipAssembler
+from utils.asf_renderer import AsfConfigRenderer, account_values
+
+# Archives larger than this many bytes are moved from memory to a temporary file on disk
+EXPORT_SPOOL_SIZE = getattr(config, 'EXPORT_SPOOL_SIZE', 8 * 1024 * 1024)
+
+# Exports sent to Telegram are split into archives of at most this many bytes
+# (Bot API refuses uploads larger than 50 MB)
+EXPORT_PART_SIZE = getattr(config, 'EXPORT_PART_SIZE', 45 * 1024 * 1024)
+
+# Name of the file listing bots removed since the previous ASF export in delta archives
+ASF_REMOVED_MANIFEST = "removed_bots.txt"
+
+def new_export_file():
+    """Returns spooled temporary file for building an archive, the temporary file is deleted on close"""
+    return tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+
+@contextmanager
+def building_export():
+    """Yields file for building an archive, it is closed if building fails and rewound when done"""
+    export = new_export_file()
+    try:
+        yield export
+    except BaseException:
+        export.close()
+        raise
+    export.seek(0)
 
 def create_account_zip(account_data):
-    """Creates ZIP archive with data of one account"""
-    # Create buffer for archive
-    zip_buffer = io.BytesIO()
-    
-    # Create ZIP archive in memory
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    """Creates ZIP archive with data of one account, returns file the caller must close"""
+    # Create ZIP archive in spooled file
+    with building_export() as export, zipfile.ZipFile(export, 'w', zipfile.ZIP_DEFLATED) as zip_file:
         # Create filename based on login
         account_name = account_data['login']
         
@@ -31,100 +55,176 @@ def create_account_zip(account_data):
         # Add text file to archive
         zip_file.writestr(f"{account_name}.txt", account_info)
         
-        # If there is maFile, add it to archive
-        if account_data.get('mafile') and account_data['mafile']:
-            # Save in single-line format for compatibility
-            mafile_content = json.dumps(account_data['mafile'], separators=(',', ':'))
+        # If there is maFile, load it from blob store and add it to archive
+        # (stored in single-line format for compatibility)
+        mafile_content = account_store.get_mafile_content(account_data)
+        if mafile_content:
             zip_file.writestr(f"{account_name}.maFile", mafile_content)
     
-    # Return buffer with archive
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+    return export
+
+def encode_entries(entries):
+    """Returns (name, content) entries with content encoded to bytes"""
+    return [
+        (name, content.encode('utf-8') if isinstance(content, str) else content)
+        for name, content in entries
+    ]
+
+def selected_accounts(keys):
+    """Yields (key, account) pairs of accounts with the given keys, skipping ones deleted meanwhile"""
+    for key in keys:
+        account_data = account_store.get(key)
+        if account_data is not None:
+            yield key, account_data
 
-def create_all_accounts_zip():
-    """Creates ZIP archive with all accounts"""
-    # Load all accounts
-    accounts = load_accounts()
+def iter_export_items(account_entries, account_line, final_entries=None, keys=None):
+    """Yields (entries, accounts.txt line) of accounts encoded to bytes, skipping accounts without entries.
     
-    # If there are no accounts, return None
-    if not accounts:
-        return None
+    Only accounts with keys are read if keys are given, otherwise all of them.
+    Entries returned by final_entries() after all accounts are yielded last, as one more item.
+    """
+    accounts = account_store.items() if keys is None else selected_accounts(keys)
+    for account_id, account_data in accounts:
+        entries = account_entries(account_data)
+        if entries is None:
+            continue
+        line = account_line(account_data) if account_line else ""
+        yield encode_entries(entries), line.encode('utf-8')
     
-    # Create buffer for archive
-    zip_buffer = io.BytesIO()
+    if final_entries is not None:
+        entries = final_entries()
+        if entries:
+            yield encode_entries(entries), b""
+
+def iter_export_parts(account_entries, account_line=None, part_size=None, final_entries=None, keys=None):
+    """
+    Yields archives of all accounts split at account boundaries.
     
-    # Create ZIP archive in memory
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # Create temporary directory for maFile
-        mafile_dir = "mafile"
-        
-        # Create content of accounts.txt file
-        accounts_txt = ""
-        
-        # Add each account to archive
-        for account_id, account_data in accounts.items():
-            # Add line with data in format login:password:mail:mailpassword:link
-            accounts_txt += f"{account_data['login']}:{account_data['password']}:{account_data['mail']}:{account_data['mail_password']}:{account_data['link']}\n"
-            
-            # If there is maFile, add it to archive
-            if account_data.get('mafile') and account_data['mafile']:
-                # Save in single-line format for compatibility
-                mafile_content = json.dumps(account_data['mafile'], separators=(',', ':'))
-                mafile_name = f"{account_data['login']}.maFile"
-                zip_file.writestr(f"{mafile_dir}/{mafile_name}", mafile_content)
+    Every part is a complete archive of at most part_size bytes (an account larger
+    than that gets a part of its own), with None part_size there is a single archive.
+    Size of a part is checked against an upper bound, buffered entries are
+    compressed before a part is finished to make the bound exact.
+    
+    Args:
+        account_entries: function returning list of (name, content) entries of account,
+            None skips the account
+        account_line: function returning accounts.txt line of account,
+            parts have no accounts.txt if None
+        part_size: maximum size of a part in bytes
+        final_entries: function returning list of (name, content) entries added
+            after all accounts, it is called once the accounts are read
+        keys: keys of exported accounts (selected by a filter), None exports all of them
+    
+    Yields:
+        rewound spooled files of parts, the caller must close them
+    """
+    items = iter_export_items(account_entries, account_line, final_entries, keys)
+    item = next(items, None)
+    
+    while item is not None:
+        # Lines are collected while other entries are added, accounts.txt is written after them
+        with building_export() as export, new_export_file() as accounts_txt:
+            with ZipAssembler(export) as archive:
+                def part_size_bound(entries, line):
+                    bound = archive.size_bound() + sum(
+                        ZipAssembler.entry_size_bound(name, len(content)) for name, content in entries
+                    )
+                    if account_line:
+                        bound += ZipAssembler.entry_size_bound("accounts.txt", accounts_txt.tell() + len(line), streamed=True)
+                    return bound
+                
+                part_accounts = 0
+                while item is not None:
+                    entries, line = item
+                    # Start next part when the account does not fit even with compressed entries
+                    if part_size is not None and part_accounts and part_size_bound(entries, line) > part_size:
+                        archive.flush()
+                        if part_size_bound(entries, line) > part_size:
+                            break
+                    
+                    for name, content in entries:
+                        archive.add(name, content)
+                    accounts_txt.write(line)
+                    part_accounts += 1
+                    item = next(items, None)
+                
+                # Stream accounts.txt into archive
+                if account_line:
+                    accounts_size = accounts_txt.tell()
+                    accounts_txt.seek(0)
+                    archive.add_stream("accounts.txt", accounts_txt, accounts_size)
         
-        # Add accounts.txt file to archive
-        zip_file.writestr("accounts.txt", accounts_txt)
+        yield export
+
+def all_accounts_line(account_data):
+    """Returns accounts.txt line with data in format login:password:mail:mailpassword:link"""
+    return f"{account_data['login']}:{account_data['password']}:{account_data['mail']}:{account_data['mail_password']}:{account_data['link']}\n"
+
+def all_accounts_entries(account_data):
+    """Returns archive entries of account besides its accounts.txt line"""
+    # If there is maFile, load it from blob store and add it to archive
+    # (stored in single-line format for compatibility)
+    mafile_content = account_store.get_mafile_content(account_data)
+    if not mafile_content:
+        return []
     
-    # Return buffer with archive
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+    # maFiles are kept in mafile directory
+    return [(f"mafile/{account_data['login']}.maFile", mafile_content)]
 
-def create_asf_configs_zip(template_json):
-    """Creates ZIP archive with ASF configs for all accounts"""
-    # Load all accounts
-    accounts = load_accounts()
+def iter_all_accounts_zip_parts(part_size=EXPORT_PART_SIZE, keys=None):
+    """Yields parts of archive with all accounts (or ones with keys), each with its own accounts.txt and mafile directory.
     
-    # If there are no accounts, return None
-    if not accounts:
-        return None
+    Parts are written incrementally to spooled files, so memory use does not grow
+    with the number of accounts; maFiles of large stores are compressed in a process pool.
+    """
+    return iter_export_parts(all_accounts_entries, all_accounts_line, part_size, keys=keys)
+
+def iter_asf_configs_zip_parts(template_json, part_size=EXPORT_PART_SIZE, export=None):
+    """Yields parts of archive with ASF configs and maFiles for all accounts.
     
+    Configs and maFiles of large stores are compressed in a process pool.
+    Nothing is yielded if the template is not a valid JSON object.
+    With export (AsfExport) only accounts it selected by filter and counts as changed
+    are written, names of all exported bots are collected to it and the last part gets
+    the manifest of bots removed since the previous export.
+    """
     try:
-        # Load ASF config template
-        template = json.loads(template_json)
-    except json.JSONDecodeError:
-        return None
+        # Load ASF config template, it is serialized once and filled for every account
+        renderer = AsfConfigRenderer.from_json(template_json)
+    except ValueError:
+        return
+    
+    def asf_entries(account_data):
+        # Skip accounts without login or password
+        if not account_data.get('login') or account_data['login'] == "missing" or not account_data.get('password') or account_data['password'] == "missing":
+            return None
+        
+        # Unchanged accounts are only counted as exported bots
+        if export is not None:
+            export.names.add(account_data['login'])
+            if not export.is_changed(account_data):
+                return None
+        
+        # Fill login, password and optional fields of account into template and add config to archive
+        entries = [(f"{account_data['login']}.json", renderer.render(account_values(account_data)))]
+        
+        # If there is maFile, load it from blob store and add it to archive
+        # (stored in single-line format for compatibility)
+        mafile_content = account_store.get_mafile_content(account_data)
+        if mafile_content:
+            entries.append((f"{account_data['login']}.maFile", mafile_content))
+        return entries
     
-    # Create buffer for archive
-    zip_buffer = io.BytesIO()
+    def removed_entries():
+        # Bots whose configs should be deleted, one name per line
+        removed = export.removed()
+        if not removed:
+            return []
+        return [(ASF_REMOVED_MANIFEST, "".join(f"{name}\n" for name in removed))]
     
-    # Create ZIP archive in memory
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # Add each account to archive
-        for account_id, account_data in accounts.items():
-            # Skip accounts without login or password
-            if not account_data.get('login') or account_data['login'] == "missing" or not account_data.get('password') or account_data['password'] == "missing":
-                continue
-            
-            # Create copy of template for this account
-            account_config = template.copy()
-            
-            # Replace login and password in template
-            account_config['SteamLogin'] = account_data['login']
-            account_config['SteamPassword'] = account_data['password']
-            
-            # Convert config to JSON and add to archive
-            config_content = json.dumps(account_config, indent=2)
-            config_name = f"{account_data['login']}.json"
-            zip_file.writestr(config_name, config_content)
-            
-            # If there is maFile, add it to archive
-            if account_data.get('mafile') and account_data['mafile']:
-                # Save in single-line format for compatibility
-                mafile_content = json.dumps(account_data['mafile'], separators=(',', ':'))
-                mafile_name = f"{account_data['login']}.maFile"
-                zip_file.writestr(mafile_name, mafile_content)
+    if export is None:
+        yield from iter_export_parts(asf_entries, part_size=part_size)
+        return
     
-    # Return buffer with archive
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue() 
\ No newline at end of file
+    yield from iter_export_parts(asf_entries, part_size=part_size, final_entries=removed_entries, keys=export.keys)
+    export.finished = True
\ No newline at end of file
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+
+class GroupCommitWriter:
+    """Single writer task that coalesces storage changes into one flush.
+
+    Changes reported with notify() within delay_ms (or until max_ops changes
+    are collected) are written to disk by one call of the blocking flush function,
+    which runs in the default executor so the event loop is not blocked.
+    """
+
+    def __init__(self, flush, delay_ms, max_ops):
+        self._flush = flush
+        self.delay = delay_ms / 1000
+        self.max_ops = max_ops
+        self._loop = None
+        self._task = None
+        self._pending = 0
+        self._waiters = []
+        self._inflight = None
+        self._changed = None
+        self._full = None
+
+    def start(self):
+        """Starting writer task on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        """Stopping writer task and flushing remaining changes"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._flush_pending()
+
+    def notify(self):
+        """Reporting a change, can be called from any thread"""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._on_change()
+        else:
+            self._loop.call_soon_threadsafe(self._on_change)
+
+    def _on_change(self):
+        self._pending += 1
+        self._changed.set()
+        if self._pending >= self.max_ops:
+            self._full.set()
+
+    async def wait_durable(self):
+        """Waiting until all changes reported so far are written to disk"""
+        if self._pending:
+            waiters = self._waiters
+        elif self._inflight is not None:
+            # Changes are being written right now
+            waiters = self._inflight
+        else:
+            return
+        waiter = self._loop.create_future()
+        waiters.append(waiter)
+        await waiter
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+
+            # Give other changes a short window to join this flush
+            try:
+                await asyncio.wait_for(self._full.wait(), self.delay)
+            except asyncio.TimeoutError:
+                pass
+
+            await self._flush_pending()
+
+    async def _flush_pending(self):
+        self._changed.clear()
+        self._full.clear()
+        pending, self._pending = self._pending, 0
+        waiters, self._waiters = self._waiters, []
+        self._inflight = waiters
+
+        try:
+            await self._loop.run_in_executor(None, self._flush)
+        except Exception as e:
+            self._inflight = None
+            logging.error(f"Error writing {pending} storage changes: {e}")
+            # Keep changes pending so the next flush retries them
+            self._pending += pending
+            self._changed.set()
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            await asyncio.sleep(self.delay)
+            return
+
+        self._inflight = None
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
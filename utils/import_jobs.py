@@ -0,0 +1,115 @@
+import time
+import asyncio
+import logging
+import threading
+import config
+from utils.account_manager import ImportStats
+
+# Progress message of an import job is edited at most once per this many seconds
+IMPORT_PROGRESS_INTERVAL = getattr(config, 'IMPORT_PROGRESS_INTERVAL', 3)
+
+class ImportJob:
+    """Import running in background.
+
+    stats are updated by the import thread while it runs,
+    cancel() asks it to stop after the current batch.
+    """
+
+    def __init__(self, job_id, chat_id, name):
+        self.id = job_id
+        self.chat_id = chat_id
+        self.name = name
+        self.stats = ImportStats()
+        self.started = time.monotonic()
+        self.cancel_event = threading.Event()
+        self.task = None
+        # Message showing progress and result of the job
+        self.message = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def elapsed(self):
+        """Seconds since the job was started"""
+        return int(time.monotonic() - self.started)
+
+    def cancel(self):
+        """Asking import to stop, batches written so far are kept"""
+        self.cancel_event.set()
+
+class ImportJobs:
+    """Registry of running import jobs"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._next_id = 1
+
+    def new_job(self, chat_id, name):
+        """Creates job with a new id, it is registered when started"""
+        job = ImportJob(self._next_id, chat_id, name)
+        self._next_id += 1
+        return job
+
+    def start(self, job, run, report, finish):
+        """Starting import job on the running event loop.
+
+        run(job) is the coroutine doing the import and returning its stats,
+        report(job) is awaited at most once per IMPORT_PROGRESS_INTERVAL seconds
+        while counters change, finish(job, stats) is awaited after progress reports
+        are stopped (stats is None if the import failed).
+        """
+        self._jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job, run, report, finish))
+        return job
+
+    async def _run(self, job, run, report, finish):
+        progress = asyncio.create_task(self._report_progress(job, report))
+        stats = None
+        try:
+            stats = await run(job)
+        except Exception as e:
+            logging.error(f"Import job {job.id} failed: {e}")
+        finally:
+            # Stop progress reports, so they do not overwrite the result
+            progress.cancel()
+            await asyncio.gather(progress, return_exceptions=True)
+            del self._jobs[job.id]
+
+        try:
+            await finish(job, stats)
+        except Exception as e:
+            logging.error(f"Error reporting result of import job {job.id}: {e}")
+
+    async def _report_progress(self, job, report):
+        reported = None
+        while True:
+            await asyncio.sleep(IMPORT_PROGRESS_INTERVAL)
+            counters = job.stats.processed, job.stats.error_count
+            if counters == reported:
+                continue
+            reported = counters
+            try:
+                await report(job)
+            except Exception as e:
+                # Progress is best effort, the import goes on
+                logging.warning(f"Error reporting progress of import job {job.id}: {e}")
+
+    def get(self, job_id):
+        """Returns running job by id or None"""
+        return self._jobs.get(job_id)
+
+    def running(self, chat_id=None):
+        """Returns running jobs, only of the given chat if chat_id is set"""
+        return [job for job in self._jobs.values() if chat_id is None or job.chat_id == chat_id]
+
+    async def stop(self):
+        """Cancelling all jobs and waiting for them to finish"""
+        jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*(job.task for job in jobs), return_exceptions=True)
+
+# Shared registry of import jobs
+import_jobs = ImportJobs()
@@ -0,0 +1,118 @@
+import re
+from functools import lru_cache
+
+# Delimiters detected in account lines, ':' is used when neither is found
+DETECTED_DELIMITERS = ('\t', ';')
+
+# Number of leading lines looked at to detect the delimiter
+DELIMITER_SAMPLE_LINES = 100
+
+# Password of login:password line that is ordinary text or a URL rather than account data
+TEXT_PASSWORD = re.compile(r'^//|\s')
+
+@lru_cache(maxsize=None)
+def line_pattern(delimiter):
+    """Returns compiled pattern matching every line of a buffer with the given delimiter.
+
+    Account lines are login:password, login:password:link and
+    login:password:mail:mail_password[:link], where a link after password
+    must start with http(s):// so three plain fields are not taken for one.
+    Password must not be empty, collect_records() also rejects login:password
+    lines whose password has spaces or starts with // (ordinary text and URLs).
+    Groups are login, password, mail, mail_password, link, SteamID of /profiles/ link
+    (vanity /id/ links have none)
+    and, for lines that are not account data, the whole line as other.
+    """
+    d = re.escape(delimiter)
+    field = f'[^{d}\\r\\n]'
+    # BOM and leading spaces are skipped, tab is not padding when it is the delimiter
+    padding = '[ \\ufeff]*' if delimiter == '\t' else '[ \\t\\ufeff]*'
+    return re.compile(
+        f'^{padding}(?:'
+        f'(?P<login>{field}+){d}(?P<password>{field}+)'
+        f'(?:{d}(?P<mail>{field}*){d}(?!//)(?P<mail_password>{field}*))?'
+        f'(?:{d}(?P<link>(?(mail)|https?://)(?:[^\\r\\n]*profiles/(?P<steam_id>\\d+))?[^\\r\\n]*))?'
+        '\\r?$'
+        '|(?P<other>[^\\n]*)$)',
+        re.MULTILINE
+    )
+
+def detect_delimiter(text):
+    """Detecting delimiter of account lines.
+
+    Tab or ';' is used only if most sampled lines are not account lines with ':'
+    but are with it, so a ';' or tab inside a password does not switch the delimiter.
+    """
+    sample = [line for line in text.lstrip('\ufeff').split('\n', DELIMITER_SAMPLE_LINES)[:DELIMITER_SAMPLE_LINES] if line.strip()]
+    records, rejected = collect_records(line_pattern(':').findall('\n'.join(sample)))
+    if len(rejected) * 2 < len(sample):
+        return ':'
+
+    misfits = '\n'.join(sample[line_number - 1] for line_number in rejected)
+    for delimiter in DETECTED_DELIMITERS:
+        records, rejected = collect_records(line_pattern(delimiter).findall(misfits))
+        if records and len(records) * 2 >= len(sample):
+            return delimiter
+    return ':'
+
+def parse_accounts_text(text, delimiter=None):
+    """
+    Parsing buffer of account lines at once.
+
+    Lines may end with CRLF and the buffer may start with BOM,
+    the delimiter is detected from the first lines unless given.
+
+    Args:
+        text: decoded text with one account per line
+        delimiter: ':', ';' or tab, detected when None
+
+    Returns:
+        tuple: (records, rejected), where records is a list of (line number, account data)
+        and rejected is a list of numbers of non-empty lines that are not account data
+    """
+    if delimiter is None:
+        delimiter = detect_delimiter(text)
+
+    return collect_records(line_pattern(delimiter).findall(text))
+
+def collect_records(lines):
+    """Building (records, rejected) from pattern groups of every line"""
+    records = []
+    rejected = []
+    for line_number, (login, password, mail, mail_password, link, steam_id, other) in enumerate(lines, 1):
+        if not login:
+            if other.strip():
+                rejected.append(line_number)
+            continue
+
+        # Trailing spaces end up in the last field of the line
+        if link:
+            link = link.rstrip()
+        elif mail_password:
+            mail_password = mail_password.rstrip()
+        else:
+            password = password.rstrip()
+            # login:password lines are told apart from text like "Note: see https://..."
+            if not mail and not mail_password and (not password or TEXT_PASSWORD.search(password)):
+                rejected.append(line_number)
+                continue
+
+        records.append((line_number, {
+            'login': login,
+            'password': password,
+            'mail': mail or "missing",
+            'mail_password': mail_password or "missing",
+            'r_code': "missing",
+            'steam_id': steam_id,
+            'link': link,
+            'mafile': {}
+        }))
+
+    return records, rejected
+
+def parse_account_line(line):
+    """Parsing one account line, returns None if it is not account data"""
+    records, rejected = parse_accounts_text(line.strip())
+    if len(records) != 1 or rejected:
+        return None
+    return records[0][1]
\ No newline at end of file
@@ -0,0 +1,118 @@
+import os
+import json
+import queue
+import hashlib
+import logging
+import threading
+import config
+
+# Directory for single-line .maFile copies of imported maFiles, None disables them
+MAFILE_EXPORT_DIR = getattr(config, 'MAFILE_EXPORT_DIR', 'mafiles')
+
+# Maximum number of maFiles written by one batch of the background writer
+MAFILE_WRITE_BATCH = getattr(config, 'MAFILE_WRITE_BATCH', 200)
+
+class MafileWriter:
+    """Writes .maFile copies from a background thread in batches.
+
+    Files are placed in root/<shard>/<name>.maFile, where shard is the first
+    two hex digits of the name hash (SteamIDs share their first digits, so the
+    name itself would put everything into one directory).
+    Files whose content did not change are not rewritten.
+    """
+
+    def __init__(self, root, batch_size):
+        self.root = root
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        # Name comes from the maFile, it must not point outside of root
+        name = os.path.basename(name)
+        shard = hashlib.md5(name.encode('utf-8')).hexdigest()[:2]
+        return os.path.join(self.root, shard, f"{name}.maFile")
+
+    def submit(self, name, mafile_data):
+        """Queues maFile for writing, returns immediately"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mafile-writer", daemon=True)
+                self._thread.start()
+        self._queue.put((name, mafile_data))
+
+    def _run(self):
+        while True:
+            # Wait for the first maFile, then take whatever else is queued
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            written = 0
+            for item in batch:
+                try:
+                    if item is not None and self._write(*item):
+                        written += 1
+                except OSError as e:
+                    logging.error(f"Error writing maFile {item[0]}: {e}")
+                finally:
+                    self._queue.task_done()
+            if written:
+                logging.info(f"Written {written} maFiles to {self.root}")
+
+            if None in batch:
+                return
+
+    def _write(self, name, mafile_data):
+        """Writes maFile unless file with the same content exists, returns True if written"""
+        # Save maFile in single-line format for compatibility
+        content = json.dumps(mafile_data, separators=(',', ':')).encode('utf-8')
+        path = self._path(name)
+
+        try:
+            with open(path, 'rb') as f:
+                if f.read() == content:
+                    return False
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        return True
+
+    def close(self):
+        """Writing queued maFiles and stopping background thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+def mafile_name(account_data):
+    """Returns .maFile name of account: SteamID if present, otherwise maFile account name"""
+    mafile_data = account_data.get('mafile') or {}
+    steam_id = (mafile_data.get('Session') or {}).get('SteamID', "missing")
+    if steam_id != "missing":
+        return str(steam_id)
+    return mafile_data.get('account_name')
+
+# Shared writer instance
+mafile_writer = MafileWriter(MAFILE_EXPORT_DIR, MAFILE_WRITE_BATCH) if MAFILE_EXPORT_DIR else None
+
+def queue_mafile_copy(account_data):
+    """Queues .maFile copy of account parsed from maFile (does nothing for other records)"""
+    if mafile_writer is None or not account_data or not account_data.get('mafile'):
+        return
+    # A copy is optional, so a maFile it can not be made of does not fail the import
+    try:
+        name = mafile_name(account_data)
+        if name:
+            mafile_writer.submit(name, account_data['mafile'])
+    except Exception as e:
+        logging.error(f"Error queuing maFile copy of {account_data.get('login')}: {e}")
@@ -50,21 +50,19 @@ def format_account_message(account_data, context):
     )
 
 def get_account_list_markup(accounts, page=0, items_per_page=10, context=None):
-    """Creating keyboard with account list considering user language"""
+    """Creating keyboard with account list considering user language.
+    
+    accounts is the account store, only the requested page is read from it.
+    """
     lang = get_user_language(context) if context else 'ru'
     keyboard = []
     
-    # Get list of account keys
-    account_keys = list(accounts.keys())
-    
-    # Calculate start and end indices for current page
-    start_idx = page * items_per_page
-    end_idx = min(start_idx + items_per_page, len(account_keys))
+    # Get accounts of current page from storage
+    page_items = accounts.page(page, items_per_page)
+    end_idx = page * items_per_page + len(page_items)
     
     # Add buttons for each account on current page
-    for i in range(start_idx, end_idx):
-        key = account_keys[i]
-        account = accounts[key]
+    for key, account in page_items:
         # Use login or SteamID as button text
         button_text = account.get('login', key)
         keyboard.append([InlineKeyboardButton(button_text, callback_data=f"account_{key}")])
@@ -73,7 +71,7 @@ def get_account_list_markup(accounts, page=0, items_per_page=10, context=None):
     navigation = []
     if page > 0:
         navigation.append(InlineKeyboardButton(get_text("btn_prev_page", lang), callback_data=f"page_{page-1}"))
-    if end_idx < len(account_keys):
+    if end_idx < len(accounts):
         navigation.append(InlineKeyboardButton(get_text("btn_next_page", lang), callback_data=f"page_{page+1}"))
     
     if navigation:
@@ -0,0 +1,44 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import config
+
+# Number of processes for CPU-bound work of imports and exports
+# (parsing maFiles, compressing archive entries), None uses all CPU cores
+PROCESS_WORKERS = getattr(config, 'PROCESS_WORKERS', None)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def process_workers():
+    """Returns number of processes in the shared pool"""
+    return PROCESS_WORKERS or os.cpu_count() or 1
+
+def get_process_pool():
+    """Returns the shared process pool, created on first call, or None if there is only one CPU core"""
+    global _pool
+    if process_workers() < 2:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers do not inherit threads and open files of the bot
+            _pool = ProcessPoolExecutor(process_workers(), mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def process_map(func, items):
+    """Returns iterator over func applied to items list in the shared pool, in the order of items"""
+    pool = get_process_pool()
+    if pool is None:
+        return map(func, items)
+    # A few chunks per worker keep them busy without per-item overhead
+    chunksize = max(1, len(items) // (process_workers() * 4))
+    return pool.map(func, items, chunksize=chunksize)
+
+def shutdown_process_pool():
+    """Stopping the shared process pool if it was started"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
\ No newline at end of file
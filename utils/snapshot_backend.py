@@ -0,0 +1,259 @@
+import os
+import json
+import re
+import mmap
+import logging
+import threading
+from collections import OrderedDict
+from itertools import islice
+from utils.account_record import Account
+from utils.storage_backends import JournalBackend, IDENTITY_FIELDS, STAMP_FIELD, identity_values, write_json_atomic
+
+# Modification stamp and maFile reference in a compact snapshot line, found without decoding the line
+SNAPSHOT_STAMP = re.compile(rb'"%s":(\d+)' % STAMP_FIELD.encode('ascii'))
+SNAPSHOT_MAFILE_REF = re.compile(rb'"mafile_ref":"([0-9a-f]+)"')
+
+def encode_line(key, account_data):
+    """Encodes snapshot line: compact ["key", account] JSON"""
+    return (json.dumps([key, account_data], separators=(',', ':')) + "\n").encode('utf-8')
+
+def map_file(path):
+    """Maps file read-only, returns None for empty or missing file"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, 'rb') as f:
+        # Mapping stays valid after the file is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class SnapshotAccounts:
+    """Ordered {key: Account} mapping over a memory-mapped snapshot.
+
+    Values are either Account records changed since the snapshot was written
+    or (mapping, offset, length) locations of snapshot lines, which are decoded
+    only when requested. The last cache_size decoded records are kept in an LRU cache.
+    """
+
+    def __init__(self, locations=None, cache_size=1024):
+        self._locations = locations if locations is not None else {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _decode(self, key, location):
+        if isinstance(location, Account):
+            return location
+
+        with self._lock:
+            cached = self._cache.get(key)
+            # Cached record is valid only for the location it was decoded from
+            if cached is not None and cached[0] is location:
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        snapshot, offset, length = location
+        account = Account.from_dict(json.loads(snapshot[offset:offset + length])[1])
+
+        with self._lock:
+            self._cache[key] = (location, account)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return account
+
+    def get(self, key, default=None):
+        location = self._locations.get(key)
+        if location is None:
+            return default
+        return self._decode(key, location)
+
+    def __getitem__(self, key):
+        return self._decode(key, self._locations[key])
+
+    def __setitem__(self, key, account):
+        self._locations[key] = account
+
+    def pop(self, key, default=None):
+        location = self._locations.pop(key, None)
+        if location is None:
+            return default
+        account = self._decode(key, location)
+        with self._lock:
+            self._cache.pop(key, None)
+        return account
+
+    def __contains__(self, key):
+        return key in self._locations
+
+    def __len__(self):
+        return len(self._locations)
+
+    def __iter__(self):
+        return iter(self._locations)
+
+    def keys(self):
+        return self._locations.keys()
+
+    def items(self):
+        # Iterate over a copy, records are decoded one by one
+        for key, location in list(self._locations.items()):
+            yield key, self._decode(key, location)
+
+    def values(self):
+        for key, account in self.items():
+            yield account
+
+    def page(self, offset, limit):
+        """Returns (key, Account) pairs of the page, decoding only them"""
+        page_items = list(islice(self._locations.items(), offset, offset + limit))
+        return [(key, self._decode(key, location)) for key, location in page_items]
+
+    def locations(self):
+        """Returns copy of {key: location}"""
+        return dict(self._locations)
+
+    def rebase(self, frozen, snapshot, records):
+        """Pointing records unchanged since freezing to their lines in the new snapshot"""
+        for key, offset, length in records:
+            if key in self._locations and self._locations[key] is frozen[key]:
+                self._locations[key] = (snapshot, offset, length)
+
+def line_bytes(key, location):
+    """Returns snapshot line of record: copied as is from the old snapshot or encoded"""
+    if isinstance(location, Account):
+        return encode_line(key, location.to_dict())
+    snapshot, offset, length = location
+    return snapshot[offset:offset + length]
+
+class SnapshotBackend(JournalBackend):
+    """Journal backend with a memory-mapped JSON-lines snapshot.
+
+    Every snapshot line is a compact ["key", account] record. The index file
+    keeps key -> (offset, length) of every line and the identity indexes,
+    so loading does not decode records and a single account is decoded only
+    when it is read. Changes are appended to the journal and held in memory
+    until compaction rewrites the snapshot.
+    """
+
+    def __init__(self, path, blobs, compact_size, cache_size):
+        super().__init__(path, blobs, compact_size)
+        self.index_path = f"{path}.idx"
+        self.cache_size = cache_size
+        self._accounts = SnapshotAccounts(cache_size=cache_size)
+
+    def _reset(self, accounts):
+        self._accounts = SnapshotAccounts(cache_size=self.cache_size)
+        self._index = {field: {} for field in IDENTITY_FIELDS}
+        for key, account_data in accounts.items():
+            self._put(key, account_data)
+
+    def _load_snapshot(self):
+        """Mapping snapshot and loading its index"""
+        snapshot = map_file(self.path)
+        if snapshot is None:
+            self._reset({})
+            return
+
+        index = self._read_index(snapshot)
+        locations = {key: (snapshot, offset, length) for key, offset, length in index['records']}
+        self._accounts = SnapshotAccounts(locations, self.cache_size)
+        self._index = index['identities']
+
+    def _snapshot_stamp(self):
+        """Returns [size, modification time] identifying the snapshot file"""
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _read_index(self, snapshot):
+        """Reading index file, rebuilding it from the snapshot if it is missing or stale"""
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if index.get('snapshot') == self._snapshot_stamp():
+                return index
+        except (OSError, json.JSONDecodeError):
+            pass
+
+        logging.warning(f"Rebuilding snapshot index {self.index_path}")
+        records = []
+        identities = {field: {} for field in IDENTITY_FIELDS}
+        offset = 0
+        while offset < len(snapshot):
+            end = snapshot.find(b"\n", offset)
+            end = len(snapshot) if end == -1 else end + 1
+            key, account_data = json.loads(snapshot[offset:end])
+            records.append((key, offset, end - offset))
+            for field, value in identity_values(account_data).items():
+                identities[field][value] = key
+            offset = end
+
+        index = {'snapshot': self._snapshot_stamp(), 'records': records, 'identities': identities}
+        write_json_atomic(self.index_path, index, separators=(',', ':'))
+        return index
+
+    def items(self):
+        return ((key, account.to_dict()) for key, account in self._accounts.items())
+
+    def _scan(self, pattern):
+        """Returns (records changed since the snapshot, pattern matches in snapshot lines).
+
+        Snapshot lines are searched instead of decoded, lines of records replaced
+        since the snapshot are searched too.
+        """
+        with self._lock:
+            locations = self._accounts.locations()
+        changed = []
+        snapshots = {}
+        for location in locations.values():
+            if isinstance(location, Account):
+                changed.append(location)
+            else:
+                snapshots[id(location[0])] = location[0]
+        return changed, [value for snapshot in snapshots.values() for value in pattern.findall(snapshot)]
+
+    def max_stamp(self):
+        """Returns the largest modification stamp, a stamp of a replaced line is only safer"""
+        changed, stamps = self._scan(SNAPSHOT_STAMP)
+        return max([account.modified or 0 for account in changed] + [int(stamp) for stamp in stamps], default=0)
+
+    def collect_garbage(self):
+        """Deleting maFile blobs not referenced by any account, blobs of replaced lines are kept until compaction"""
+        changed, refs = self._scan(SNAPSHOT_MAFILE_REF)
+        refs = {ref.decode('ascii') for ref in refs}
+        refs.update(account.mafile_ref for account in changed if account.mafile_ref)
+        return self.blobs.retain(refs)
+
+    def page(self, offset, limit):
+        return [(key, account.to_dict()) for key, account in self._accounts.page(offset, limit)]
+
+    def _freeze(self):
+        """Returns locations and identity indexes to be written as the new snapshot"""
+        identities = {field: dict(values) for field, values in self._index.items()}
+        return self._accounts.locations(), identities
+
+    def _write_snapshot(self, snapshot):
+        frozen, identities = snapshot
+        try:
+            records = []
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                for key, location in frozen.items():
+                    line = line_bytes(key, location)
+                    records.append((key, f.tell(), len(line)))
+                    f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Index is checked against size and modification time of the snapshot
+            # (kept by rename), stale index is rebuilt on load
+            stat = os.stat(tmp_path)
+            index = {'snapshot': [stat.st_size, stat.st_mtime_ns], 'records': records, 'identities': identities}
+            write_json_atomic(f"{self.index_path}.new", index, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            os.replace(f"{self.index_path}.new", self.index_path)
+
+            with self._lock:
+                self._accounts.rebase(frozen, map_file(self.path), records)
+            os.remove(self.rotated_path)
+            logging.info(f"Journal compacted, snapshot has {len(records)} accounts")
+        except OSError as e:
+            logging.error(f"Error compacting journal: {e}")
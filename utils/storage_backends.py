@@ -0,0 +1,699 @@
+import json
+import os
+import sqlite3
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from utils.account_record import Account
+from utils.blob_store import SqliteBlobStore
+
+# Account fields stored in separate columns of the SQLite backend
+ACCOUNT_FIELDS = ('login', 'password', 'mail', 'mail_password', 'r_code', 'steam_id', 'link')
+
+# Fields referencing maFile kept in the blob store
+MAFILE_FIELDS = ('mafile_account', 'mafile_ref')
+
+# Modification stamp set by the account store on every upsert
+STAMP_FIELD = 'modified'
+
+# Columns of the SQLite backend left out of records when they are NULL
+EXTRA_COLUMNS = MAFILE_FIELDS + (STAMP_FIELD,)
+
+# Identities an account can be found by, in matching priority order
+IDENTITY_FIELDS = ('steam_id', 'login', 'mafile_account')
+
+def identity_values(account_data):
+    """Returns normalized identities of account: {field: value}.
+
+    Logins are case-insensitive on Steam, so they are lowercased.
+    """
+    values = {}
+    steam_id = account_data.get('steam_id')
+    if steam_id and steam_id != "missing":
+        values['steam_id'] = str(steam_id)
+    login = account_data.get('login')
+    if login and login != "missing":
+        values['login'] = login.lower()
+    mafile_account = account_data.get('mafile_account') or (account_data.get('mafile') or {}).get('account_name')
+    if mafile_account:
+        values['mafile_account'] = mafile_account.lower()
+    return values
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """Writes JSON to temporary file and atomically replaces the target with it"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, **dump_kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def externalize_mafile(account_data, blobs):
+    """Moving embedded maFile of account into blob store.
+
+    Returns account data where maFile is replaced by its reference (mafile_ref)
+    and account name (mafile_account), records without maFile lose the empty mafile field.
+    """
+    if 'mafile' not in account_data:
+        return account_data
+
+    account_data = dict(account_data)
+    mafile = account_data.pop('mafile')
+    if mafile:
+        account_data['mafile_ref'] = blobs.put(mafile)
+        account_data['mafile_account'] = mafile.get('account_name')
+    return account_data
+
+def accounts_to_json(accounts):
+    """Converts {key: Account} to the accounts.json shape"""
+    return {key: account.to_dict() for key, account in accounts.items()}
+
+class JsonBackend:
+    """Keeps all accounts in memory and writes them to a JSON file.
+
+    Accounts are held as compact Account records and converted to dicts
+    when they are read or written.
+
+    In deferred mode changes only mark the store dirty and the file is written by flush().
+    maFile bodies are kept in the blobs store, records only reference them.
+    """
+
+    def __init__(self, path, blobs):
+        self.path = path
+        self.blobs = blobs
+        self.meta_path = f"{path}.meta"
+        self.fingerprints_path = f"{path}.fingerprints"
+        self.deferred = False
+        self._accounts = {}
+        self._index = {field: {} for field in IDENTITY_FIELDS}
+        self._dirty = False
+        self._lock = threading.RLock()
+        # Metadata and fingerprint files are read, changed and replaced as a whole
+        self._meta_lock = threading.Lock()
+
+    def load(self):
+        """Loading accounts data from file"""
+        if not os.path.exists(self.path):
+            self._reset({})
+            self._save()
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                self._reset(json.load(f))
+        except json.JSONDecodeError:
+            logging.error(f"Error reading file {self.path}. Creating new file.")
+            self._reset({})
+            self._save()
+
+    # Accounts dictionary and identity indexes are changed only by these methods
+
+    def _put(self, key, account_data):
+        self._remove(key)
+        self._accounts[key] = Account.from_dict(account_data)
+        for field, value in identity_values(account_data).items():
+            self._index[field][value] = key
+
+    def _remove(self, key):
+        account = self._accounts.pop(key, None)
+        if account is None:
+            return False
+        for field, value in identity_values(account.to_dict()).items():
+            if self._index[field].get(value) == key:
+                del self._index[field][value]
+        return True
+
+    def _reset(self, accounts):
+        self._accounts = {}
+        self._index = {field: {} for field in IDENTITY_FIELDS}
+        for key, account_data in accounts.items():
+            self._put(key, account_data)
+
+    def _save(self):
+        """Saving accounts data to file"""
+        write_json_atomic(self.path, accounts_to_json(self._accounts), indent=2)
+
+    def _changed(self):
+        """Saving changes now or leaving them for flush() in deferred mode"""
+        if self.deferred:
+            self._dirty = True
+        else:
+            self._save()
+
+    def flush(self):
+        """Writing deferred changes to disk"""
+        with self._lock:
+            if not self._dirty:
+                return
+            # Records stay shared with the snapshot copy, they are never modified in place
+            snapshot = dict(self._accounts)
+            self._dirty = False
+
+        try:
+            write_json_atomic(self.path, accounts_to_json(snapshot), indent=2)
+        except OSError:
+            self._dirty = True
+            raise
+
+    def get(self, key):
+        account = self._accounts.get(key)
+        return account.to_dict() if account is not None else None
+
+    def contains(self, key):
+        return key in self._accounts
+
+    def find_key(self, field, value):
+        """Returns key of account with the given normalized identity"""
+        return self._index[field].get(value)
+
+    def count(self):
+        return len(self._accounts)
+
+    def max_stamp(self):
+        """Returns the largest modification stamp of stored accounts, 0 if there is none"""
+        with self._lock:
+            return max((account.modified or 0 for account in self._accounts.values()), default=0)
+
+    def keys(self):
+        # Iterate over a copy, accounts may be changed from another thread meanwhile
+        with self._lock:
+            return iter(list(self._accounts.keys()))
+
+    def items(self):
+        with self._lock:
+            snapshot = list(self._accounts.items())
+        return ((key, account.to_dict()) for key, account in snapshot)
+
+    def page(self, offset, limit):
+        with self._lock:
+            page_items = list(islice(self._accounts.items(), offset, offset + limit))
+        return [(key, account.to_dict()) for key, account in page_items]
+
+    def upsert_many(self, items, deletes=()):
+        with self._lock:
+            for key in deletes:
+                self._remove(key)
+            for key, account_data in items:
+                self._put(key, account_data)
+            self._changed()
+
+    def delete(self, key):
+        with self._lock:
+            if not self._remove(key):
+                return False
+            self._changed()
+        return True
+
+    def clear(self):
+        # maFile blobs are deleted by collect_garbage() on next start,
+        # so records restored after a crash never point to deleted blobs
+        with self._lock:
+            self._reset({})
+            self._changed()
+
+    def collect_garbage(self):
+        """Deleting maFile blobs not referenced by any account"""
+        with self._lock:
+            refs = {account.mafile_ref for account in self._accounts.values() if account.mafile_ref}
+        return self.blobs.retain(refs)
+
+    def get_meta(self, name):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, 'r') as f:
+            return json.load(f).get(name)
+
+    def set_meta(self, name, value):
+        with self._meta_lock:
+            meta = {}
+            if os.path.exists(self.meta_path):
+                with open(self.meta_path, 'r') as f:
+                    meta = json.load(f)
+            meta[name] = value
+            write_json_atomic(self.meta_path, meta)
+
+    def get_fingerprints(self):
+        """Returns {fingerprint: key} of imported records, the oldest first"""
+        if not os.path.exists(self.fingerprints_path):
+            return {}
+        with open(self.fingerprints_path, 'r') as f:
+            return json.load(f)
+
+    def add_fingerprints(self, items, limit=None):
+        """Adding (fingerprint, key) pairs as the newest ones, only the last limit fingerprints are kept"""
+        with self._meta_lock:
+            known = self.get_fingerprints()
+            for fingerprint, key in items:
+                known.pop(fingerprint, None)
+                known[fingerprint] = key
+            if limit is not None:
+                for fingerprint in list(islice(known, max(0, len(known) - limit))):
+                    del known[fingerprint]
+            write_json_atomic(self.fingerprints_path, known, separators=(',', ':'))
+
+    def close(self):
+        self.flush()
+
+class JournalBackend(JsonBackend):
+    """Keeps all accounts in memory, writes changes to an append-only journal.
+
+    Every upsert or delete is appended to the journal as one compact JSON line,
+    so a change costs O(record) instead of rewriting the whole file.
+    On startup the snapshot (accounts.json) is loaded and the journal replayed.
+    When the journal grows past compact_size bytes, it is rotated and the snapshot
+    is rewritten in a background thread.
+    """
+
+    def __init__(self, path, blobs, compact_size):
+        super().__init__(path, blobs)
+        self.journal_path = f"{path}.journal"
+        self.rotated_path = f"{path}.journal.old"
+        self.compact_size = compact_size
+        self._journal = None
+        self._compaction = None
+
+    def load(self):
+        """Loading snapshot and replaying journal on top of it"""
+        self._load_snapshot()
+
+        # Rotated journal is left only if the process died during compaction
+        replayed = 0
+        for path in (self.rotated_path, self.journal_path):
+            replayed += self._replay(path)
+        if replayed:
+            logging.info(f"Replayed {replayed} journal records")
+
+        self._journal = open(self.journal_path, 'a')
+
+    def _load_snapshot(self):
+        """Loading accounts.json snapshot"""
+        super().load()
+
+    def _replay(self, path):
+        """Applying journal records from file"""
+        if not os.path.exists(path):
+            return 0
+
+        count = 0
+        with open(path, 'rb+') as f:
+            offset = 0
+            for line in f:
+                # Last record may be cut if the process died while writing it,
+                # it is cut off so records appended after it start on their own line
+                if not line.endswith(b"\n"):
+                    logging.warning(f"Truncating damaged last record of journal {path}")
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping damaged record in journal {path}")
+                    continue
+                self._apply(entry)
+                count += 1
+        return count
+
+    def _apply(self, entry):
+        if entry['op'] == 'put':
+            self._put(entry['key'], entry['value'])
+        elif entry['op'] == 'del':
+            self._remove(entry['key'])
+        elif entry['op'] == 'clear':
+            self._reset({})
+
+    def _save(self):
+        """Snapshot is written only by compaction"""
+        pass
+
+    def _append(self, entries):
+        """Appending records to journal and syncing it to disk (or in flush() in deferred mode)"""
+        with self._lock:
+            for entry in entries:
+                self._apply(entry)
+                self._journal.write(json.dumps(entry, separators=(',', ':')) + "\n")
+            self._journal.flush()
+            if self.deferred:
+                self._dirty = True
+            else:
+                os.fsync(self._journal.fileno())
+
+            if self._journal.tell() >= self.compact_size:
+                self.compact()
+
+    def flush(self):
+        """Syncing appended journal records to disk"""
+        with self._lock:
+            if not self._dirty:
+                return
+            os.fsync(self._journal.fileno())
+            self._dirty = False
+
+    def upsert_many(self, items, deletes=()):
+        entries = [{'op': 'del', 'key': key} for key in deletes]
+        entries.extend({'op': 'put', 'key': key, 'value': value} for key, value in items)
+        self._append(entries)
+
+    def delete(self, key):
+        if key not in self._accounts:
+            return False
+        self._append([{'op': 'del', 'key': key}])
+        return True
+
+    def clear(self):
+        self._append([{'op': 'clear'}])
+
+    def compact(self):
+        """Rotating journal and rewriting snapshot in background thread"""
+        with self._lock:
+            # Previous compaction is still running
+            if self._compaction is not None and self._compaction.is_alive():
+                return
+
+            snapshot = self._freeze()
+            # Deferred records are synced before flush() stops seeing them
+            if self._dirty:
+                os.fsync(self._journal.fileno())
+            self._journal.close()
+            self._dirty = False
+            if os.path.exists(self.rotated_path):
+                # Previous compaction failed, its records are not in the snapshot yet
+                with open(self.rotated_path, 'a') as rotated, open(self.journal_path, 'r') as journal:
+                    shutil.copyfileobj(journal, rotated)
+                    rotated.flush()
+                    os.fsync(rotated.fileno())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.rotated_path)
+            self._journal = open(self.journal_path, 'a')
+
+            self._compaction = threading.Thread(
+                target=self._write_snapshot,
+                args=(snapshot,),
+                name="journal-compaction",
+                daemon=True
+            )
+            self._compaction.start()
+
+    def _freeze(self):
+        """Returns copy of accounts to be written as the new snapshot"""
+        # Records stay shared with the snapshot copy, they are never modified in place
+        return dict(self._accounts)
+
+    def _write_snapshot(self, snapshot):
+        try:
+            write_json_atomic(self.path, accounts_to_json(snapshot), separators=(',', ':'))
+            os.remove(self.rotated_path)
+            logging.info(f"Journal compacted, snapshot has {len(snapshot)} accounts")
+        except OSError as e:
+            logging.error(f"Error compacting journal: {e}")
+
+    def close(self):
+        if self._compaction is not None:
+            self._compaction.join()
+        if self._journal is not None:
+            self.flush()
+            self._journal.close()
+            self._journal = None
+
+class SqliteBackend:
+    """Stores accounts in SQLite database.
+
+    Account fields are columns of the accounts table with indexes on steam_id,
+    login, mail and maFile account name, maFile payloads are kept in the separate
+    content-addressed blobs table.
+    Only requested rows are read, nothing is cached in memory.
+    In deferred mode changes stay in an open transaction until flush().
+    """
+
+    # Number of rows read at once by keys() and items()
+    READ_CHUNK_SIZE = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.deferred = False
+        self.blobs = SqliteBlobStore(self)
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def load(self):
+        """Opening database and creating schema if needed"""
+        # Transactions are managed explicitly in _write() and flush()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS accounts (
+                    key TEXT PRIMARY KEY,
+                    login TEXT,
+                    password TEXT,
+                    mail TEXT,
+                    mail_password TEXT,
+                    r_code TEXT,
+                    steam_id TEXT,
+                    link TEXT,
+                    mafile_account TEXT,
+                    mafile_ref TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_accounts_steam_id ON accounts(steam_id);
+                CREATE INDEX IF NOT EXISTS idx_accounts_mail ON accounts(mail);
+                CREATE TABLE IF NOT EXISTS blobs (
+                    ref TEXT PRIMARY KEY,
+                    body TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    fingerprint TEXT PRIMARY KEY,
+                    key TEXT NOT NULL
+                );
+            """)
+
+            with self._write():
+                self._upgrade_schema()
+
+            # Logins are matched case-insensitively
+            self._conn.executescript("""
+                DROP INDEX IF EXISTS idx_accounts_login;
+                CREATE INDEX IF NOT EXISTS idx_accounts_login_nocase ON accounts(login COLLATE NOCASE);
+                CREATE INDEX IF NOT EXISTS idx_accounts_mafile_account ON accounts(mafile_account);
+                CREATE INDEX IF NOT EXISTS idx_accounts_mafile_ref ON accounts(mafile_ref);
+            """)
+
+    def _upgrade_schema(self):
+        """Upgrading databases created by older versions"""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(accounts)")]
+        for column in MAFILE_FIELDS:
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE accounts ADD COLUMN {column} TEXT")
+        if STAMP_FIELD not in columns:
+            self._conn.execute(f"ALTER TABLE accounts ADD COLUMN {STAMP_FIELD} INTEGER")
+
+        # maFiles were kept per account in the mafiles table before the blob store
+        has_mafiles = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mafiles'"
+        ).fetchone()
+        if not has_mafiles:
+            return
+
+        for key, body in self._conn.execute("SELECT key, body FROM mafiles").fetchall():
+            mafile = json.loads(body)
+            self._conn.execute(
+                "UPDATE accounts SET mafile_ref = ?, mafile_account = ? WHERE key = ?",
+                (self.blobs.put(mafile), mafile.get('account_name'), key)
+            )
+        self._conn.execute("DROP TABLE mafiles")
+        logging.info("maFiles moved to blobs table")
+
+    @contextmanager
+    def _write(self):
+        """Running statements in a savepoint, committing it unless in deferred mode"""
+        with self._lock:
+            outermost = not self._conn.in_transaction
+            if outermost:
+                self._conn.execute("BEGIN")
+            self._conn.execute("SAVEPOINT write")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK TO write")
+                self._conn.execute("RELEASE write")
+                raise
+            self._conn.execute("RELEASE write")
+            if outermost and not self.deferred:
+                self._conn.execute("COMMIT")
+
+    def flush(self):
+        """Committing deferred changes"""
+        with self._lock:
+            if self._conn.in_transaction:
+                self._conn.execute("COMMIT")
+
+    def _row_to_account(self, row):
+        """Converting (key, fields...) row to account dict"""
+        account_data = dict(zip(ACCOUNT_FIELDS, row[1:]))
+        for field, value in zip(EXTRA_COLUMNS, row[1 + len(ACCOUNT_FIELDS):]):
+            if value is not None:
+                account_data[field] = value
+        return row[0], account_data
+
+    def _select(self, where="", params=(), tail=""):
+        columns = ", ".join(ACCOUNT_FIELDS + EXTRA_COLUMNS)
+        return self._conn.execute(
+            f"SELECT key, {columns} FROM accounts {where} ORDER BY rowid {tail}",
+            params
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._select("WHERE key = ?", (key,)).fetchone()
+        return self._row_to_account(row)[1] if row else None
+
+    def contains(self, key):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM accounts WHERE key = ?", (key,)).fetchone() is not None
+
+    def find_key(self, field, value):
+        """Returns key of account with the given normalized identity"""
+        condition = {
+            'steam_id': "steam_id = ?",
+            'login': "login = ? COLLATE NOCASE",
+            'mafile_account': "mafile_account = ?",
+        }[field]
+        with self._lock:
+            row = self._conn.execute(f"SELECT key FROM accounts WHERE {condition} LIMIT 1", (value,)).fetchone()
+        return row[0] if row else None
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+
+    def max_stamp(self):
+        """Returns the largest modification stamp of stored accounts, 0 if there is none"""
+        with self._lock:
+            return self._conn.execute(f"SELECT MAX({STAMP_FIELD}) FROM accounts").fetchone()[0] or 0
+
+    def _chunks(self):
+        """Yields rows in chunks of READ_CHUNK_SIZE.
+
+        The connection is locked only while a chunk is read,
+        so writes from other threads are not blocked by a long iteration.
+        """
+        columns = ", ".join(ACCOUNT_FIELDS + EXTRA_COLUMNS)
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT rowid, key, {columns} FROM accounts WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, self.READ_CHUNK_SIZE)
+                ).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            yield [row[1:] for row in rows]
+
+    def keys(self):
+        return (row[0] for rows in self._chunks() for row in rows)
+
+    def items(self):
+        return (self._row_to_account(row) for rows in self._chunks() for row in rows)
+
+    def page(self, offset, limit):
+        with self._lock:
+            rows = self._select(tail="LIMIT ? OFFSET ?", params=(limit, offset)).fetchall()
+        return [self._row_to_account(row) for row in rows]
+
+    def upsert_many(self, items, deletes=()):
+        fields = ACCOUNT_FIELDS + EXTRA_COLUMNS
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{field} = excluded.{field}" for field in fields)
+        with self._write():
+            for key in deletes:
+                self._conn.execute("DELETE FROM accounts WHERE key = ?", (key,))
+            for key, account_data in items:
+                # Upsert keeps rowid of existing row, so list order stays stable
+                values = [account_data.get(field) for field in ACCOUNT_FIELDS]
+                values.append(identity_values(account_data).get('mafile_account'))
+                values.append(account_data.get('mafile_ref'))
+                values.append(account_data.get(STAMP_FIELD))
+                self._conn.execute(
+                    f"INSERT INTO accounts (key, {columns}) VALUES (?, {placeholders}) "
+                    f"ON CONFLICT(key) DO UPDATE SET {updates}",
+                    (key, *values)
+                )
+
+    def delete(self, key):
+        with self._write():
+            cursor = self._conn.execute("DELETE FROM accounts WHERE key = ?", (key,))
+        return cursor.rowcount > 0
+
+    def clear(self):
+        with self._write():
+            self._conn.execute("DELETE FROM accounts")
+            self._conn.execute("DELETE FROM blobs")
+
+    def collect_garbage(self):
+        """Deleting maFile blobs not referenced by any account"""
+        return self.blobs.retain()
+
+    def get_meta(self, name):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name, value):
+        with self._write():
+            self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def get_fingerprints(self):
+        """Returns {fingerprint: key} of imported records, the oldest first"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT fingerprint, key FROM fingerprints ORDER BY rowid"))
+
+    def add_fingerprints(self, items, limit=None):
+        """Adding (fingerprint, key) pairs as the newest ones, only the last limit fingerprints are kept"""
+        with self._write() as conn:
+            # Replaced rows get new rowids, so rowid order is the order fingerprints were added in
+            conn.executemany("INSERT OR REPLACE INTO fingerprints (fingerprint, key) VALUES (?, ?)", items)
+            if limit is not None:
+                conn.execute(
+                    "DELETE FROM fingerprints WHERE rowid <= "
+                    "(SELECT rowid FROM fingerprints ORDER BY rowid DESC LIMIT 1 OFFSET ?)",
+                    (limit,)
+                )
+
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+def migrate_json_accounts(json_path, backend):
+    """One-shot migration of accounts.json into SQLite or snapshot backend.
+
+    Runs only if the JSON file exists and it was not migrated before.
+    Returns number of migrated accounts.
+    """
+    if backend.get_meta('migrated_from_json') or not os.path.exists(json_path):
+        return 0
+
+    try:
+        with open(json_path, 'r') as f:
+            accounts = json.load(f)
+    except json.JSONDecodeError:
+        logging.error(f"Error reading file {json_path}. Nothing to migrate.")
+        return 0
+
+    items = [
+        (key, externalize_mafile(account_data, backend.blobs))
+        for key, account_data in accounts.items()
+    ]
+    backend.blobs.sync()
+    backend.upsert_many(items)
+    backend.set_meta('migrated_from_json', json_path)
+    logging.info(f"Migrated {len(accounts)} accounts from {json_path} to {backend.path}")
+    return len(accounts)
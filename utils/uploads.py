@@ -0,0 +1,52 @@
+import hashlib
+import tempfile
+import config
+from telegram.error import BadRequest
+
+# Maximum size of uploaded document in bytes, the cloud Bot API serves files up to 20 MB
+# (larger values need a local Bot API server)
+MAX_UPLOAD_SIZE = getattr(config, 'MAX_UPLOAD_SIZE', 20 * 1024 * 1024)
+
+class UploadTooLarge(Exception):
+    """Uploaded document is larger than MAX_UPLOAD_SIZE"""
+
+async def download_document(bot, document):
+    """Downloads document into a temporary file on disk.
+
+    A real file rather than a SpooledTemporaryFile, which before Python 3.11
+    has no seekable() and can not be read by zipfile.
+    Returns the file rewound to the start, the caller must close it
+    (the temporary file is deleted on close).
+    Raises UploadTooLarge if the document is larger than MAX_UPLOAD_SIZE
+    or than the Bot API server lets bots download.
+    """
+    # Size reported by Telegram lets us refuse before downloading anything
+    if document.file_size and document.file_size > MAX_UPLOAD_SIZE:
+        raise UploadTooLarge(document.file_size)
+
+    upload = tempfile.TemporaryFile()
+    try:
+        try:
+            file = await bot.get_file(document.file_id)
+        except BadRequest as e:
+            # Bot API refuses files above its own limit with "File is too big"
+            if "too big" in str(e).lower():
+                raise UploadTooLarge(document.file_size) from e
+            raise
+        await file.download_to_memory(upload)
+        if upload.tell() > MAX_UPLOAD_SIZE:
+            raise UploadTooLarge(upload.tell())
+        upload.seek(0)
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+def hash_upload(upload):
+    """Returns SHA-256 of downloaded file content and rewinds it"""
+    digest = hashlib.sha256()
+    upload.seek(0)
+    for chunk in iter(lambda: upload.read(1024 * 1024), b""):
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
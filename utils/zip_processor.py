@@ -1,96 +1,117 @@
-import os
-import json
+import csv
 import zipfile
-import tempfile
 import logging
-from io import BytesIO
 
-def process_zip_archive(zip_bytes):
+# Kinds of items yielded by iter_zip_archive()
+ZIP_LINE = 'line'
+# CSV row with its columns joined by CSV_ROW_DELIMITER
+ZIP_CSV_ROW = 'csv_row'
+ZIP_MAFILE = 'mafile'
+ZIP_ERROR = 'error'
+
+# Delimiter CSV columns are joined with, so values containing ':' or ';' stay in their columns
+CSV_ROW_DELIMITER = '\t'
+
+def decode_text(data):
+    """Decodes bytes as UTF-8, falling back to cp1251"""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('cp1251')
+
+def iter_text_lines(lines, name):
+    """Yields (ZIP_LINE, "name:N", line) items of non-empty lines.
+
+    lines is any iterable of bytes or str lines: file object, list, split message.
+    """
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = decode_text(line)
+        line = line.strip()
+        if line:
+            yield ZIP_LINE, f"{name}:{line_number}", line
+
+def iter_csv_lines(lines, name):
+    """Yields ZIP_CSV_ROW items of CSV rows (login,password,...), header row is skipped"""
+    for index, (kind, item_name, line) in enumerate(iter_text_lines(lines, name)):
+        row = [field.strip() for field in next(csv.reader([line]))]
+        if index == 0 and row[0].lower() == 'login':
+            continue
+        if any(CSV_ROW_DELIMITER in field for field in row):
+            yield ZIP_ERROR, item_name, f"{item_name}: tab inside CSV field"
+            continue
+        yield ZIP_CSV_ROW, item_name, CSV_ROW_DELIMITER.join(row)
+
+def iter_text_file(source, name):
+    """Streams uploaded .txt or .csv file (binary file object) line by line"""
+    if name.lower().endswith('.csv'):
+        return iter_csv_lines(source, name)
+    return iter_text_lines(source, name)
+
+def find_mafiles(file_list):
+    """Returns maFiles of archive: from mafile/ directory or, if there are none, from root"""
+    mafiles = [
+        file_path for file_path in file_list
+        if file_path.lower().startswith('mafile/') and file_path.lower().endswith('.mafile')
+    ]
+    if not mafiles:
+        mafiles = [
+            file_path for file_path in file_list
+            if file_path.lower().endswith('.mafile') and '/' not in file_path
+        ]
+    return mafiles
+
+def iter_zip_archive(source):
     """
-    Processes ZIP archive, extracts account data and maFiles.
-    
+    Streams ZIP archive with accounts.txt and maFiles item by item.
+
+    Members are read one at a time and accounts.txt is read line by line,
+    so memory does not grow with the archive size.
+
     Args:
-        zip_bytes: byte content of ZIP archive
-        
-    Returns:
-        tuple: (list of lines from accounts.txt, list of maFile contents, list of errors)
+        source: path or binary file object of ZIP archive
+
+    Yields:
+        tuple: (kind, name, content), where kind is ZIP_LINE (name is "accounts.txt:N",
+        content is the line), ZIP_MAFILE (name is the member path, content is raw maFile bytes,
+        decoded by the parser) or ZIP_ERROR (content is the error message)
     """
-    processed_accounts = []
-    processed_mafiles = []
-    errors = []
-    
     try:
-        # Create temporary directory for extraction
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Open ZIP archive
-            with zipfile.ZipFile(BytesIO(zip_bytes), 'r') as zip_ref:
-                # Get list of files in archive
-                file_list = zip_ref.namelist()
-                
-                # Look for accounts.txt
-                accounts_txt_path = None
-                for file_path in file_list:
-                    if file_path.lower().endswith('accounts.txt'):
-                        accounts_txt_path = file_path
-                        break
-                
-                # Process accounts.txt if found
-                if accounts_txt_path:
-                    try:
-                        with zip_ref.open(accounts_txt_path) as accounts_file:
-                            try:
-                                content = accounts_file.read().decode('utf-8')
-                            except UnicodeDecodeError:
-                                content = accounts_file.read().decode('cp1251')
-                            
-                            # Process each line
-                            for line in content.split('\n'):
-                                if line.strip():
-                                    processed_accounts.append(line.strip())
-                    except Exception as e:
-                        errors.append(f"Error processing accounts.txt: {str(e)}")
-                else:
-                    errors.append("File accounts.txt not found in archive")
-                
-                # Look for mafile directory or .mafile files in root
-                mafile_dir = None
-                mafiles = []
-                
-                # First check for mafile/ directory
-                for file_path in file_list:
-                    if file_path.lower().startswith('mafile/') and file_path.lower().endswith('.mafile'):
-                        mafiles.append(file_path)
-                
-                # If directory not found, look for .mafile in root
-                if not mafiles:
-                    for file_path in file_list:
-                        if file_path.lower().endswith('.mafile') and '/' not in file_path:
-                            mafiles.append(file_path)
-                
-                # Process found mafiles
-                for mafile_path in mafiles:
-                    try:
-                        with zip_ref.open(mafile_path) as mafile:
-                            try:
-                                content = mafile.read().decode('utf-8')
-                            except UnicodeDecodeError:
-                                content = mafile.read().decode('cp1251')
-                            
-                            # Check that it's valid JSON
-                            try:
-                                json_content = json.loads(content)
-                                processed_mafiles.append(content)
-                            except json.JSONDecodeError:
-                                errors.append(f"File {mafile_path} is not valid JSON")
-                    except Exception as e:
-                        errors.append(f"Error processing {mafile_path}: {str(e)}")
-                
-                if not mafiles:
-                    errors.append(".mafile files not found in archive")
-    
+        with zipfile.ZipFile(source, 'r') as zip_ref:
+            file_list = zip_ref.namelist()
+
+            # Look for accounts.txt
+            accounts_txt_path = next(
+                (file_path for file_path in file_list if file_path.lower().endswith('accounts.txt')),
+                None
+            )
+
+            # Process accounts.txt line by line if found
+            if accounts_txt_path:
+                try:
+                    with zip_ref.open(accounts_txt_path) as accounts_file:
+                        yield from iter_text_lines(accounts_file, "accounts.txt")
+                except Exception as e:
+                    yield ZIP_ERROR, accounts_txt_path, f"Error processing accounts.txt: {str(e)}"
+            else:
+                yield ZIP_ERROR, None, "File accounts.txt not found in archive"
+
+            # Process found maFiles one by one
+            mafiles = find_mafiles(file_list)
+            for mafile_path in mafiles:
+                try:
+                    with zip_ref.open(mafile_path) as mafile:
+                        content = mafile.read()
+                except Exception as e:
+                    yield ZIP_ERROR, mafile_path, f"Error processing {mafile_path}: {str(e)}"
+                    continue
+                yield ZIP_MAFILE, mafile_path, content
+
+            if not mafiles:
+                yield ZIP_ERROR, None, ".mafile files not found in archive"
+
     except zipfile.BadZipFile:
-        errors.append("Invalid ZIP archive")
+        yield ZIP_ERROR, None, "Invalid ZIP archive"
     except Exception as e:
-        errors.append(f"Error processing archive: {str(e)}")
-    
-    return processed_accounts, processed_mafiles, errors 
\ No newline at end of file
+        logging.error(f"Error processing archive: {e}")
+        yield ZIP_ERROR, None, f"Error processing archive: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,203 @@
+import time
+import zlib
+import struct
+import zipfile
+import config
+from utils.process_pool import process_map
+
+# Entries smaller than this many bytes are stored, deflate would not make them smaller
+ZIP_STORE_SIZE = 64
+
+# Entries of at least this many bytes are compressed with the fastest level,
+# smaller ones with the default level, which costs little on them
+ZIP_FAST_SIZE = getattr(config, 'ZIP_FAST_SIZE', 1024 * 1024)
+
+# Archives with at least this many entries are compressed in the shared process pool,
+# entries are sent to it in windows of this size
+ZIP_PARALLEL_THRESHOLD = getattr(config, 'ZIP_PARALLEL_THRESHOLD', 2000)
+
+# Chunk size for reading streamed entries
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+CENTRAL_HEADER = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+DATA_DESCRIPTOR = struct.Struct('<4sLLL')
+ZIP64_END_RECORD = struct.Struct('<4sQHHLLQQQQ')
+ZIP64_END_LOCATOR = struct.Struct('<4sLQL')
+END_RECORD = struct.Struct('<4sHHHHLLH')
+
+# Bytes of headers added for every entry besides its name (local and central directory),
+# and bytes of end records of the archive
+ENTRY_OVERHEAD = LOCAL_HEADER.size + CENTRAL_HEADER.size
+END_OVERHEAD = ZIP64_END_RECORD.size + ZIP64_END_LOCATOR.size + END_RECORD.size
+
+# General purpose flags: sizes follow the data, UTF-8 file name
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+def compression_level(size):
+    """Returns deflate level for entry of the given size"""
+    return 1 if size >= ZIP_FAST_SIZE else zlib.Z_DEFAULT_COMPRESSION
+
+def compress_entry(entry):
+    """Compresses (name, data) entry, returns (name, method, CRC, size, stored data)"""
+    name, data = entry
+    size = len(data)
+    crc = zlib.crc32(data)
+    if size >= ZIP_STORE_SIZE:
+        compressor = zlib.compressobj(compression_level(size), zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < size:
+            return name, zipfile.ZIP_DEFLATED, crc, size, compressed
+    return name, zipfile.ZIP_STORED, crc, size, data
+
+def dos_date_time(timestamp):
+    """Returns (time, date) of timestamp in MS-DOS format used by ZIP headers"""
+    t = time.localtime(timestamp)
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    )
+
+class ZipAssembler:
+    """
+    Writes ZIP archive from entries compressed apart from each other.
+
+    Entries added with add() are buffered and compressed in windows,
+    once ZIP_PARALLEL_THRESHOLD of them are collected the rest of the archive
+    is compressed in the shared process pool (unless there is only one CPU core).
+    Entries are written in the order they were added, so only one window
+    of entries is held in memory.
+    Use as a context manager, the central directory is written on exit.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._offset = file.tell()
+        self._pending = []
+        self._pending_size = 0
+        self._directory_size = 0
+        self._central = []
+        self._parallel = False
+        self._date_time = dos_date_time(time.time())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def add(self, name, data):
+        """Adding entry with bytes or str data, it is compressed with others later"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._pending.append((name, data))
+        encoded_length = len(name.encode('utf-8'))
+        self._pending_size += LOCAL_HEADER.size + encoded_length + len(data)
+        self._directory_size += CENTRAL_HEADER.size + encoded_length
+        if len(self._pending) >= ZIP_PARALLEL_THRESHOLD:
+            self._parallel = True
+            self._flush_pending()
+
+    def add_stream(self, name, source, size):
+        """Adding entry read from binary file object in chunks, compressed in this thread"""
+        self._flush_pending()
+        self._directory_size += CENTRAL_HEADER.size + len(name.encode('utf-8'))
+
+        flags = FLAG_DATA_DESCRIPTOR | self._name_flags(name)
+        method = zipfile.ZIP_DEFLATED
+        header_offset = self._write_local_header(name, flags, method, 0, 0, 0)
+
+        compressor = zlib.compressobj(compression_level(size), zlib.DEFLATED, -15)
+        crc = 0
+        size = 0
+        compressed_size = 0
+        for chunk in iter(lambda: source.read(STREAM_CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            compressed_size += self._write(compressor.compress(chunk))
+        compressed_size += self._write(compressor.flush())
+
+        self._write(DATA_DESCRIPTOR.pack(b'PK\x07\x08', crc, compressed_size, size))
+        self._central.append((name, flags, method, crc, compressed_size, size, header_offset))
+
+    @staticmethod
+    def entry_size_bound(name, size, streamed=False):
+        """Returns upper bound of bytes entry of the given size adds to archive"""
+        if streamed:
+            # Deflate may grow incompressible data a little, sizes follow the data
+            size += size // 1000 + 64 + DATA_DESCRIPTOR.size
+        return ENTRY_OVERHEAD + 2 * len(name.encode('utf-8')) + size
+
+    def size_bound(self):
+        """Returns upper bound of archive size if it was closed now, buffered entries are counted uncompressed"""
+        return self._offset + self._pending_size + self._directory_size + END_OVERHEAD
+
+    def flush(self):
+        """Compressing and writing buffered entries, so size_bound() counts them compressed"""
+        self._flush_pending()
+
+    def close(self):
+        """Writing remaining entries and central directory"""
+        self._flush_pending()
+
+        directory_offset = self._offset
+        for name, flags, method, crc, compressed_size, size, header_offset in self._central:
+            encoded_name = name.encode('utf-8')
+            self._write(CENTRAL_HEADER.pack(
+                b'PK\x01\x02', 20, 20, flags, method, *self._date_time,
+                crc, compressed_size, size, len(encoded_name), 0, 0, 0, 0, 0o600 << 16, header_offset
+            ))
+            self._write(encoded_name)
+        directory_size = self._offset - directory_offset
+
+        # More than 65535 entries need ZIP64 end of central directory
+        count = len(self._central)
+        if count > 0xFFFF or directory_offset > 0xFFFFFFFF:
+            zip64_offset = self._offset
+            self._write(ZIP64_END_RECORD.pack(
+                b'PK\x06\x06', ZIP64_END_RECORD.size - 12, 45, 45, 0, 0,
+                count, count, directory_size, directory_offset
+            ))
+            self._write(ZIP64_END_LOCATOR.pack(b'PK\x06\x07', 0, zip64_offset, 1))
+        self._write(END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(directory_size, 0xFFFFFFFF), min(directory_offset, 0xFFFFFFFF), 0
+        ))
+
+    def _flush_pending(self):
+        if not self._pending:
+            return
+        if self._parallel:
+            entries = process_map(compress_entry, self._pending)
+        else:
+            entries = map(compress_entry, self._pending)
+        for name, method, crc, size, data in entries:
+            flags = self._name_flags(name)
+            header_offset = self._write_local_header(name, flags, method, crc, len(data), size)
+            self._write(data)
+            self._central.append((name, flags, method, crc, len(data), size, header_offset))
+        self._pending = []
+        self._pending_size = 0
+
+    def _name_flags(self, name):
+        return 0 if name.isascii() else FLAG_UTF8
+
+    def _write_local_header(self, name, flags, method, crc, compressed_size, size):
+        # Entries are addressed by 32-bit offsets, archive would need ZIP64 extra fields
+        if self._offset > 0xFFFFFFFF:
+            raise zipfile.LargeZipFile("Archive is larger than 4 GB")
+        header_offset = self._offset
+        encoded_name = name.encode('utf-8')
+        self._write(LOCAL_HEADER.pack(
+            b'PK\x03\x04', 20, flags, method, *self._date_time,
+            crc, compressed_size, size, len(encoded_name), 0
+        ))
+        self._write(encoded_name)
+        return header_offset
+
+    def _write(self, data):
+        self._file.write(data)
+        self._offset += len(data)
+        return len(data)
\ No newline at end of file